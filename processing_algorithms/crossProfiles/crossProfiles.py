@@ -10,12 +10,11 @@
 *                                                                         *
 ***************************************************************************
 
-- latest changes : 2022-02-01
+- latest changes : 2026-10-18
 - https://github.com/clementroussel/qgis/tree/main/scripts/crossProfiles
-- warnings : requires SAGA 7.8.2
 """
 
-from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
 from qgis.core import (QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterVectorLayer,
@@ -24,8 +23,315 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterBand,
                        QgsProcessingParameterFeatureSink,
-                       QgsVectorLayer)
+                       QgsProcessingException,
+                       QgsFeatureSink,
+                       QgsVectorLayer,
+                       QgsFeatureRequest,
+                       QgsFeature,
+                       QgsGeometry,
+                       QgsFields,
+                       QgsField,
+                       QgsLineString,
+                       QgsMultiLineString,
+                       QgsRectangle,
+                       QgsWkbTypes,
+                       QgsMemoryProviderUtils,
+                       QgsCoordinateTransform,
+                       QgsCsException,
+                       Qgis)
 from qgis import processing
+from itertools import islice
+import numpy as np
+
+
+def batches(iterable, size):
+    """
+    Yields lists of at most size items of iterable.
+    """
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+# coordinate transforms between pairs of CRS, reused by the next runs with the same transform context
+TRANSFORMS = {}
+
+
+def coordinate_transform(source, destination, transform_context):
+    """
+    Returns the transform from the source CRS to the destination CRS,
+    None if there is nothing to transform. Transforms are cached per pair
+    of CRS and per coordinate operations of the transform context, which
+    change with the datum transformations of the project.
+    """
+    if not source.isValid() or not destination.isValid() or source == destination:
+        return None
+    key = (source.toWkt(), destination.toWkt(), repr(sorted(transform_context.coordinateOperations().items())))
+    if key not in TRANSFORMS:
+        TRANSFORMS[key] = QgsCoordinateTransform(source, destination, transform_context)
+    return TRANSFORMS[key]
+
+
+def transform_coordinates(transform, x, y):
+    """
+    Transforms arrays of coordinates at once : they are stored as the
+    vertices of a line string, which is transformed in a single call.
+    """
+    if transform is None or len(x) == 0:
+        return x, y
+    line = QgsLineString(np.asarray(x, dtype=float).tolist(), np.asarray(y, dtype=float).tolist())
+    try:
+        line.transform(transform)
+    except QgsCsException as error:
+        raise QgsProcessingException('Unable to transform the coordinates : {}'.format(error))
+    return np.array(line.xVector(), dtype=float), np.array(line.yVector(), dtype=float)
+
+
+def axis_parts(layer, invert=False):
+    """
+    Returns the parts of the features of a line layer as (n, 2) arrays of
+    coordinates, in their storage order (reversed if invert is True). No
+    attribute is fetched.
+    """
+    parts = []
+    for feature in layer.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        if not feature.hasGeometry():
+            continue
+        for part in feature.geometry().parts():
+            line = part.curveToLine()
+            parts.append(np.column_stack((line.xVector(), line.yVector())))
+    if invert:
+        parts = [part[::-1] for part in reversed(parts)]
+    return parts
+
+
+def transects(parts, spacing, length):
+    """
+    Stations regularly spaced along the axis made of the chained parts,
+    from its start, and the perpendicular profiles through them. Returns
+    the curvilinear distance of the stations and the coordinates of the
+    ends of the profiles, which stretch over length on each side of the
+    axis, from its left to its right.
+    """
+    x0 = np.concatenate([part[:-1, 0] for part in parts])
+    y0 = np.concatenate([part[:-1, 1] for part in parts])
+    dx = np.concatenate([np.diff(part[:, 0]) for part in parts])
+    dy = np.concatenate([np.diff(part[:, 1]) for part in parts])
+    segment_length = np.hypot(dx, dy)
+    # the direction of duplicated vertices is undefined
+    valid = segment_length > 0
+    x0, y0, dx, dy, segment_length = x0[valid], y0[valid], dx[valid], dy[valid], segment_length[valid]
+    if len(segment_length) == 0:
+        raise ValueError('the axis layer does not contain any line')
+
+    start = np.concatenate(([0.], np.cumsum(segment_length)[:-1]))
+    dist = np.arange(0., start[-1] + segment_length[-1], spacing)
+    segment = np.searchsorted(start, dist, side='right') - 1
+    t = (dist - start[segment]) / segment_length[segment]
+    x = x0[segment] + t * dx[segment]
+    y = y0[segment] + t * dy[segment]
+    # unit normal vector, pointing to the left of the axis
+    normal_x = -dy[segment] / segment_length[segment]
+    normal_y = dx[segment] / segment_length[segment]
+    return (dist, x + length * normal_x, y + length * normal_y,
+            x - length * normal_x, y - length * normal_y)
+
+
+def profile_features(fields, dist, left_x, left_y, right_x, right_y):
+    """
+    Yields the features of the cross-profiles returned by transects, with
+    their 'ID' and 'dist'.
+    """
+    for current in range(len(dist)):
+        feature = QgsFeature(fields)
+        feature.setGeometry(QgsGeometry(QgsLineString([left_x[current], right_x[current]],
+                                                      [left_y[current], right_y[current]])))
+        feature.setAttributes([current + 1, float(dist[current])])
+        yield feature
+
+
+class RasterSampler:
+    """
+    Vectorized sampling of a raster band : the points are grouped by
+    tiles of the raster, each tile being read once as a NumPy array. The
+    value of the cell containing each point is returned, NaN where the
+    point is outside the raster or on a no data cell.
+    """
+
+    DATA_TYPES = {Qgis.Byte: np.uint8,
+                  Qgis.UInt16: np.uint16,
+                  Qgis.Int16: np.int16,
+                  Qgis.UInt32: np.uint32,
+                  Qgis.Int32: np.int32,
+                  Qgis.Float32: np.float32,
+                  Qgis.Float64: np.float64}
+
+    TILE_SIZE = 1024
+
+    def __init__(self, raster_layer, band):
+        self.provider = raster_layer.dataProvider()
+        self.band = band
+        self.extent = raster_layer.extent()
+        self.width = raster_layer.width()
+        self.height = raster_layer.height()
+        self.cell_x = self.extent.width() / self.width
+        self.cell_y = self.extent.height() / self.height
+        self.dtype = self.DATA_TYPES.get(self.provider.dataType(band), np.float64)
+        self.nodata = None
+        if self.provider.sourceHasNoDataValue(band) and self.provider.useSourceNoDataValue(band):
+            self.nodata = self.provider.sourceNoDataValue(band)
+
+    def sample(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        values = np.full(len(x), np.nan)
+
+        col = np.floor((x - self.extent.xMinimum()) / self.cell_x).astype(np.int64)
+        row = np.floor((self.extent.yMaximum() - y) / self.cell_y).astype(np.int64)
+        inside = (col >= 0) & (col < self.width) & (row >= 0) & (row < self.height)
+
+        # group the points by tile
+        indexes = np.flatnonzero(inside)
+        tiles = (row[indexes] // self.TILE_SIZE) * (self.width // self.TILE_SIZE + 1) \
+            + col[indexes] // self.TILE_SIZE
+        order = np.argsort(tiles, kind='stable')
+        indexes, tiles = indexes[order], tiles[order]
+        bounds = np.flatnonzero(np.diff(tiles)) + 1
+
+        for selection in np.split(indexes, bounds):
+            if len(selection) == 0:
+                continue
+            col_min, col_max = col[selection].min(), col[selection].max()
+            row_min, row_max = row[selection].min(), row[selection].max()
+            block = self.read(col_min, row_min, col_max - col_min + 1, row_max - row_min + 1)
+            values[selection] = block[row[selection] - row_min, col[selection] - col_min]
+
+        return values
+
+    def read(self, col, row, cols, rows):
+        """
+        Reads a window of the raster band as a NumPy array.
+        """
+        x_min = self.extent.xMinimum() + col * self.cell_x
+        y_max = self.extent.yMaximum() - row * self.cell_y
+        extent = QgsRectangle(x_min, y_max - rows * self.cell_y, x_min + cols * self.cell_x, y_max)
+        block = self.provider.block(self.band, extent, int(cols), int(rows))
+        data = np.frombuffer(bytes(block.data()), dtype=self.dtype).reshape(int(rows), int(cols))
+        data = data.astype(float)
+        if self.nodata is not None:
+            data[data == self.nodata] = np.nan
+        return data
+
+
+class ProfileSampler:
+    """
+    Densifies the profiles and sets their Z values from the DTM in a
+    single pass : the vertices are added every subdivision length along
+    the profiles, then all the vertices of a batch of profiles are sampled
+    at once and the LineStringZ geometries are built from the arrays. The
+    statistics of the elevations of each profile are computed on the way
+    and appended to its attributes.
+    """
+
+    STATISTICS = ('z min', 'z max', 'z mean', 'thalweg', 'valid ratio')
+
+    def __init__(self, sampler, interval, ends):
+        self.sampler = sampler
+        self.interval = interval
+        # left and right ends of the unclipped profiles, by profile ID - 1
+        self.left_x, self.left_y, self.right_x, self.right_y = ends
+        # transform from the CRS of the profiles to the one of the DTM
+        self.dtm_transform = None
+        self.fields = QgsFields()
+
+    def add_fields(self, fields):
+        """
+        Sets the output fields : the fields of the profiles followed by the
+        ones of the statistics.
+        """
+        self.fields = QgsFields(fields)
+        for name in self.STATISTICS:
+            self.fields.append(QgsField(name, QVariant.Double, len=10, prec=3))
+
+    def statistics(self, profile_id, x, y, z):
+        """
+        Returns the statistics of the vertices (x, y, z) of a profile, Z
+        being NaN where the DTM has no value : the minimum, maximum and
+        mean valid Z values, the offset of the lowest vertex from the axis
+        (positive on the left of the axis) and the ratio of valid vertices.
+        """
+        valid = ~np.isnan(z)
+        ratio = float(np.count_nonzero(valid)) / len(z)
+        if not valid.any():
+            return [None, None, None, None, ratio]
+        lowest = np.flatnonzero(valid)[np.argmin(z[valid])]
+
+        # the axis is in the middle of the unclipped profile
+        index = profile_id - 1
+        direction_x = self.left_x[index] - self.right_x[index]
+        direction_y = self.left_y[index] - self.right_y[index]
+        length = np.hypot(direction_x, direction_y)
+        offset = 0.
+        if length > 0:
+            offset = ((x[lowest] - (self.left_x[index] + self.right_x[index]) / 2) * direction_x
+                      + (y[lowest] - (self.left_y[index] + self.right_y[index]) / 2) * direction_y) / length
+        return [float(z[lowest]), float(np.nanmax(z)), float(np.nanmean(z)), float(offset), ratio]
+
+    def subdivide(self, x, y):
+        """
+        Returns the vertices of a line densified like
+        native:densifygeometriesgivenaninterval : each segment is divided
+        into equal parts, floor(length / interval) + 1 of them.
+        """
+        dx, dy = np.diff(x), np.diff(y)
+        steps = np.floor(np.hypot(dx, dy) / self.interval).astype(np.int64) + 1
+        segment = np.repeat(np.arange(len(dx)), steps)
+        t = (np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+        return (np.append(x[segment] + t * dx[segment], x[-1:]),
+                np.append(y[segment] + t * dy[segment], y[-1:]))
+
+    def sample(self, features):
+        """
+        Returns copies of a batch of profiles, densified, with the Z values
+        of the DTM (0 outside the DTM and on no data cells, like
+        native:setzfromraster) and the statistics of the valid ones.
+        """
+        features = [feature for feature in features if feature.hasGeometry()]
+        parts = []
+        for feature in features:
+            lines = [part.curveToLine() for part in feature.geometry().parts()]
+            parts.append([self.subdivide(np.array(line.xVector(), dtype=float),
+                                         np.array(line.yVector(), dtype=float)) for line in lines])
+
+        # sample the vertices of the whole batch at once
+        x = np.concatenate([part[0] for feature_parts in parts for part in feature_parts] or [np.empty(0)])
+        y = np.concatenate([part[1] for feature_parts in parts for part in feature_parts] or [np.empty(0)])
+        z = self.sampler.sample(*transform_coordinates(self.dtm_transform, x, y))
+        output_z = np.where(np.isnan(z), 0., z)
+
+        sampled_features, start = [], 0
+        for feature, feature_parts in zip(features, parts):
+            lines = []
+            first = start
+            for part_x, part_y in feature_parts:
+                end = start + len(part_x)
+                lines.append(QgsLineString(part_x.tolist(), part_y.tolist(), output_z[start:end].tolist()))
+                start = end
+            if feature.geometry().isMultipart():
+                geometry = QgsMultiLineString()
+                for line in lines:
+                    geometry.addGeometry(line)
+            else:
+                geometry = lines[0]
+            sampled_feature = QgsFeature(self.fields)
+            sampled_feature.setGeometry(QgsGeometry(geometry))
+            sampled_feature.setAttributes(feature.attributes()
+                                          + self.statistics(feature.attribute('ID'), x[first:start],
+                                                            y[first:start], z[first:start]))
+            sampled_features.append(sampled_feature)
+        return sampled_features
 
 
 class CrossProfiles(QgsProcessingAlgorithm):
@@ -75,14 +381,14 @@ class CrossProfiles(QgsProcessingAlgorithm):
         <h2>Description<\h2>
         <p>Generate regularly spaced cross-profiles along an axis.<\p>
         <h2>Inputs<\h2>
-        <p>Axis layer : Should contain a single line or multiline feature.<\p>
-        <p>Distance between two profiles : self-explained.<\p>
-        <p>Profiles length : self-explained.<\p>
+        <p>Axis layer : Should contain a single line or multiline feature. The parts of a multiline axis are chained in their storage order.<\p>
+        <p>Distance between two profiles : Curvilinear distance between two consecutive profiles, the first one being at the start of the axis.<\p>
+        <p>Profiles length : Length of the profiles on each side of the axis. Profiles are perpendicular to the axis and go from its left to its right.<\p>
         <p>Extent layer : If provided, cross-profiles will be ajusted according to this layer.<\p>
         <p>Profiles subdivision length : Cross-profiles geometries are densified by adding additional vertices. This value indicates the maximum distance between two consecutive vertices.<\p>
-        <p>Digital Terrain Model (DTM) : Cross-profiles vertices Z value will be extracted from it.<\p>
+        <p>Digital Terrain Model (DTM) : Cross-profiles vertices Z value will be extracted from it, as the vertices are added, without any intermediate layer. Vertices outside the DTM or on no data cells get a zero Z value.<\p>
         <h2>Output<\h2>
-        <p>A cross-profiles layer whose attribute table contains a field 'dist' and a field 'z min' that can be used to approximate a longitudinal profile.<\p>
+        <p>A cross-profiles layer whose attribute table contains a field 'ID' (from 1), a field 'dist' and the statistics of the elevations of each profile, computed while it is sampled : 'z min' (that can be used to approximate a longitudinal profile), 'z max' and 'z mean', 'thalweg', the offset of the lowest point from the axis (positive on the left of the axis), and 'valid ratio', the ratio of vertices on valid cells of the DTM. Statistics only take the valid vertices into account.<\p>
         <\body><\html>
         """
         return self.tr(help)
@@ -176,62 +482,34 @@ class CrossProfiles(QgsProcessingAlgorithm):
         
         axis_layer = self.parameterAsVectorLayer(parameters, 'AXIS_LAYER', context)
         
-        # delete all fields from AXIS_LAYER's attribute table
-        fields = []
-        for field in axis_layer.fields():
-            fields.append(field.name())
-            
-        axis_layer = processing.run("qgis:deletecolumn",
-                                    {'INPUT':axis_layer,
-                                     'COLUMN':fields,
-                                     'OUTPUT':'TEMPORARY_OUTPUT'},
-                                    is_child_algorithm=True,
-                                    context=context,
-                                    feedback=feedback)['OUTPUT']
-                                     
-        
+        # the axis is read without its attributes and, if asked, inverted in memory
         invert_axis = self.parameterAsBool(parameters, 'INVERT_AXIS', context)
-        
-        # if asked, invert the direction of the axis' line or polyline
-        if invert_axis:
-            axis_layer = processing.run("native:reverselinedirection",
-                                        {'INPUT':axis_layer,
-                                         'OUTPUT':'TEMPORARY_OUTPUT'},
-                                        is_child_algorithm=True,
-                                        context=context,
-                                        feedback=feedback)['OUTPUT']
-
-        # create the cross-profiles layer
-        cross_profiles = processing.run("saga:crossprofiles",
-                                        {'DEM':parameters['DTM'],
-                                         'LINES':axis_layer,
-                                         'PROFILES':'TEMPORARY_OUTPUT',
-                                         'DIST_LINE':parameters['DIST_BETWEEN_PROFILES'],
-                                         'DIST_PROFILE':parameters['PROFILES_LENGTH'],
-                                         'NUM_PROFILE':3,
-                                         'INTERPOLATION':3,
-                                         'OUTPUT':0},
-                                        is_child_algorithm=True,
-                                        context=context,
-                                        feedback=feedback)['PROFILES']
-
-        # create a new field 'dist' in cross-profiles layer attribute table
-        cross_profiles = processing.run("native:fieldcalculator",
-                                        {'INPUT':cross_profiles,
-                                         'FIELD_NAME':'dist',
-                                         'FIELD_TYPE':0,
-                                         'FIELD_LENGTH':10,
-                                         'FIELD_PRECISION':3,
-                                         'FORMULA':' (\"ID\" - 1) * '+str(parameters['DIST_BETWEEN_PROFILES']),
-                                         'OUTPUT':'TEMPORARY_OUTPUT'},
-                                        is_child_algorithm=True,
-                                        context=context,
-                                        feedback=feedback)['OUTPUT']
-        
-        # clip the cross-profiles with the extent layer
+        parts = axis_parts(axis_layer, invert_axis)
+
+        spacing = self.parameterAsDouble(parameters, 'DIST_BETWEEN_PROFILES', context)
+        if spacing <= 0:
+            raise QgsProcessingException(self.tr('The distance between two profiles must be positive'))
+        try:
+            dist, left_x, left_y, right_x, right_y = transects(
+                parts, spacing, self.parameterAsDouble(parameters, 'PROFILES_LENGTH', context))
+        except ValueError as error:
+            raise QgsProcessingException(str(error))
+
+        # the cross-profiles, with a field 'dist', are handed straight to the sampling
+        fields = QgsFields()
+        fields.append(QgsField('ID', QVariant.Int))
+        fields.append(QgsField('dist', QVariant.Double, len=10, prec=3))
+        profiles = profile_features(fields, dist, left_x, left_y, right_x, right_y)
+        total = len(dist)
+        wkb_type, crs = QgsWkbTypes.LineString, axis_layer.sourceCrs()
+
+        # clip the cross-profiles with the extent layer, which needs a layer of them
         extent_layer = self.parameterAsVectorLayer(parameters, 'EXTENT', context)
 
         if isinstance(extent_layer, QgsVectorLayer):
+            cross_profiles = QgsMemoryProviderUtils.createMemoryLayer('cross profiles', fields, wkb_type, crs)
+            for batch in batches(profiles, 10000):
+                cross_profiles.dataProvider().addFeatures(batch)
             cross_profiles = processing.run("native:clip",
                                             {'INPUT':cross_profiles,
                                              'OVERLAY':extent_layer,
@@ -239,40 +517,30 @@ class CrossProfiles(QgsProcessingAlgorithm):
                                             is_child_algorithm=True,
                                             context=context,
                                             feedback=feedback)['OUTPUT']
+            # convert the result (which is a str id) as a vector layer
+            cross_profiles = context.takeResultLayer(cross_profiles)
+            profiles, total = cross_profiles.getFeatures(), cross_profiles.featureCount()
+            fields, wkb_type = cross_profiles.fields(), cross_profiles.wkbType()
+
+        # add regularly spaced vertices to the cross-profiles and set their Z value from the DTM
+        interval = self.parameterAsDouble(parameters, 'SUBDIVISIONS', context)
+        if interval <= 0:
+            raise QgsProcessingException(self.tr('The profiles subdivision length must be positive'))
+        dtm = self.parameterAsRasterLayer(parameters, 'DTM', context)
+        profile_sampler = ProfileSampler(RasterSampler(dtm, parameters['DTM_BAND']), interval,
+                                         (left_x, left_y, right_x, right_y))
+        profile_sampler.dtm_transform = coordinate_transform(crs, dtm.crs(), context.transformContext())
+        profile_sampler.add_fields(fields)
+
+        (sink, dest_id) = self.parameterAsSink(parameters, 'OUTPUT', context, profile_sampler.fields,
+                                               QgsWkbTypes.addZ(wkb_type), crs)
+        done = 0
+        for batch in batches(profiles, 1000):
+            if feedback.isCanceled():
+                break
+            sink.addFeatures(profile_sampler.sample(batch), QgsFeatureSink.FastInsert)
+            done += len(batch)
+            feedback.setProgress(100 * done / total if total else 100)
 
-        # add regularly spaced vertices to the cross-profiles
-        cross_profiles = processing.run("native:densifygeometriesgivenaninterval",
-                                        {'INPUT':cross_profiles,
-                                         'INTERVAL':parameters['SUBDIVISIONS'],
-                                         'OUTPUT':'TEMPORARY_OUTPUT'},
-                                        is_child_algorithm=True,
-                                        context=context,
-                                        feedback=feedback)['OUTPUT']
-
-        # set ;cross-profiles vertices' Z value from the DTM
-        cross_profiles = processing.run("native:setzfromraster",
-                                        {'INPUT':cross_profiles,
-                                         'RASTER':parameters['DTM'],
-                                         'BAND':parameters['DTM_BAND'],
-                                         'NODATA':0,
-                                         'SCALE':1,
-                                         'OUTPUT':'TEMPORARY_OUTPUT'},
-                                        is_child_algorithm=True,
-                                        context=context,
-                                        feedback=feedback)['OUTPUT'] 
-
-        # create a new field 'z min'
-        cross_profiles = processing.run("native:fieldcalculator",
-                                        {'INPUT':cross_profiles,
-                                         'FIELD_NAME':'z min',
-                                         'FIELD_TYPE':0,
-                                         'FIELD_LENGTH':10,
-                                         'FIELD_PRECISION':3,
-                                         'FORMULA':'z_min($geometry)',
-                                         'OUTPUT':parameters['OUTPUT']},
-                                        is_child_algorithm=True,
-                                        context=context,
-                                        feedback=feedback)['OUTPUT']                            
-                                             
         # return the results of the algorithm
-        return {'OUTPUT':cross_profiles}
+        return {'OUTPUT':dest_id}
@@ -10,20 +10,920 @@
 *                                                                         *
 ***************************************************************************
 
-- latest changes : 2022-01-27
+- latest changes : 2026-10-18
 - https://github.com/clementroussel/qgis/tree/main/scripts/pointProjection
 """
 
-from qgis.PyQt.QtCore import QCoreApplication
-from qgis.core import (QgsProcessing,
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (Qgis,
+                       QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterVectorLayer,
                        QgsProcessingParameterBoolean,
                        QgsProcessingParameterField,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterBand,
-                       QgsProcessingParameterFeatureSink)
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterDistance,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterCrs,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFileDestination,
+                       QgsProcessingException,
+                       QgsFeatureSink,
+                       QgsFeatureRequest,
+                       QgsFeature,
+                       QgsGeometry,
+                       QgsPoint,
+                       QgsFields,
+                       QgsField,
+                       QgsRectangle,
+                       QgsWkbTypes,
+                       QgsApplication,
+                       QgsMemoryProviderUtils,
+                       QgsCoordinateTransform,
+                       QgsCsException,
+                       QgsLineString,
+                       QgsVectorDataProvider)
 from qgis import processing
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import ExitStack
+from functools import partial
+from itertools import islice
+import csv
+import hashlib
+import os
+import threading
+import numpy as np
+
+
+def batches(iterable, size):
+    """
+    Yields lists of at most size items of iterable.
+    """
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def subset_layer(layer, attributes, extra_fields=()):
+    """
+    Returns a memory layer with the features of layer restricted to the
+    attributes with the given indexes, followed by empty extra fields.
+    Only these attributes are fetched, which avoids the copies made by the
+    qgis:deletecolumn algorithm.
+    """
+    fields = QgsFields()
+    for index in attributes:
+        fields.append(layer.fields().at(index))
+    for field in extra_fields:
+        fields.append(field)
+
+    subset = QgsMemoryProviderUtils.createMemoryLayer(layer.name(), fields, layer.wkbType(), layer.sourceCrs())
+    request = QgsFeatureRequest().setSubsetOfAttributes(attributes)
+    for batch in batches(layer.getFeatures(request), 10000):
+        features = []
+        for feature in batch:
+            values = feature.attributes()
+            subset_feature = QgsFeature(fields)
+            subset_feature.setGeometry(feature.geometry())
+            subset_feature.setAttributes([values[index] for index in attributes] + [None] * len(extra_fields))
+            features.append(subset_feature)
+        subset.dataProvider().addFeatures(features)
+    return subset
+
+
+# coordinate transforms between pairs of CRS, reused by the next runs with the same transform context
+TRANSFORMS = {}
+
+
+def coordinate_transform(source, destination, transform_context):
+    """
+    Returns the transform from the source CRS to the destination CRS,
+    None if there is nothing to transform. Transforms are cached per pair
+    of CRS and per coordinate operations of the transform context, which
+    change with the datum transformations of the project.
+    """
+    if not source.isValid() or not destination.isValid() or source == destination:
+        return None
+    key = (source.toWkt(), destination.toWkt(), repr(sorted(transform_context.coordinateOperations().items())))
+    if key not in TRANSFORMS:
+        TRANSFORMS[key] = QgsCoordinateTransform(source, destination, transform_context)
+    return TRANSFORMS[key]
+
+
+def transform_coordinates(transform, x, y):
+    """
+    Transforms arrays of coordinates at once : they are stored as the
+    vertices of a line string, which is transformed in a single call.
+    """
+    if transform is None or len(x) == 0:
+        return x, y
+    line = QgsLineString(np.asarray(x, dtype=float).tolist(), np.asarray(y, dtype=float).tolist())
+    try:
+        line.transform(transform)
+    except QgsCsException as error:
+        raise QgsProcessingException('Unable to transform the coordinates : {}'.format(error))
+    return np.array(line.xVector(), dtype=float), np.array(line.yVector(), dtype=float)
+
+
+def feature_hash(feature, attributes):
+    """
+    Returns a hash of the geometry of a feature and of the given
+    attributes, to find out whether it changed since the previous run.
+    """
+    digest = hashlib.sha1(bytes(feature.geometry().asWkb()))
+    digest.update(repr(attributes).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def reach_keys(layer, field_name):
+    """
+    Returns the key of the reach of each feature of an axis layer, by
+    feature id, and the reach ID of each key : the features sharing the
+    same value of the reach ID field form a single reach, the keys being
+    numbered in the order in which the values first appear.
+    """
+    index = layer.fields().indexOf(field_name)
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes([index])
+    keys, values = {}, {}
+    for feature in layer.getFeatures(request):
+        value = feature.attributes()[index]
+        # NULL values are all the same reach
+        if isinstance(value, QVariant):
+            value = None
+        keys[feature.id()] = values.setdefault(value, len(values))
+    return keys, {key: value for value, key in values.items()}
+
+
+class AxisModel:
+    """
+    In-memory model of the axis : its segments, the curvilinear distance
+    at the start of each of them and a packed R-tree over the segments.
+    The parts of a multiline axis are chained in the order in which they
+    are stored. An axis may also be a network of reaches, each segment
+    keeping the key of its reach : the curvilinear distance then starts
+    from 0 at the beginning of every reach.
+    """
+
+    # number of children of each node of the R-tree
+    NODE_CAPACITY = 16
+
+    # number of points searched at once in the R-tree
+    CHUNK_SIZE = 4096
+
+    def __init__(self, parts, reaches=None):
+        if reaches is None:
+            reaches = [0] * len(parts)
+        x0, y0, x1, y1, reach = [], [], [], [], []
+        for part, key in zip(parts, reaches):
+            if len(part) < 2:
+                continue
+            x0.append(part[:-1, 0])
+            y0.append(part[:-1, 1])
+            x1.append(part[1:, 0])
+            y1.append(part[1:, 1])
+            reach.append(np.full(len(part) - 1, key, dtype=np.int64))
+        if len(x0) == 0:
+            raise ValueError('the axis layer does not contain any line')
+        self.x0 = np.concatenate(x0)
+        self.y0 = np.concatenate(y0)
+        self.dx = np.concatenate(x1) - self.x0
+        self.dy = np.concatenate(y1) - self.y0
+        self.length = np.hypot(self.dx, self.dy)
+        self.reach = np.concatenate(reach)
+        # the parts of a reach are consecutive : restart the cumulated length at each new reach
+        total = np.concatenate(([0.], np.cumsum(self.length)[:-1]))
+        first = np.flatnonzero(np.diff(self.reach, prepend=self.reach[0] - 1))
+        self.start = total - np.repeat(total[first], np.diff(np.append(first, len(total))))
+        self.total = total
+        # avoid dividing by zero on duplicated vertices
+        self.length2 = np.where(self.length > 0, self.length ** 2, 1.)
+        self.build_index()
+
+    @classmethod
+    def from_layer(cls, layer, invert=False, reach_field=None):
+        """
+        Builds the axis model from the features of a line layer. If a
+        reach ID field is given, the features sharing the same ID are
+        chained into a reach whose key is given by reach_keys, else all the
+        features are chained into a single axis.
+        """
+        keys = reach_keys(layer, reach_field)[0] if reach_field else {}
+        # parts of each reach, in the order of the keys
+        reaches = {}
+        request = QgsFeatureRequest().setNoAttributes()
+        for feature in layer.getFeatures(request):
+            if not feature.hasGeometry():
+                continue
+            parts = reaches.setdefault(keys.get(feature.id(), 0), [])
+            for part in feature.geometry().parts():
+                line = part.curveToLine()
+                parts.append(np.column_stack((line.xVector(), line.yVector())))
+        reaches = sorted(reaches.items())
+        if invert:
+            reaches = [(key, [part[::-1] for part in reversed(parts)]) for key, parts in reversed(reaches)]
+        return cls([part for _, parts in reaches for part in parts],
+                   [key for key, parts in reaches for _ in parts])
+
+    def state(self):
+        """
+        Returns the arrays describing the model, R-tree included.
+        """
+        state = {'x0': self.x0, 'y0': self.y0, 'dx': self.dx, 'dy': self.dy,
+                 'length': self.length, 'start': self.start, 'reach': self.reach}
+        for level, boxes in enumerate(self.levels):
+            state['level_{}'.format(level)] = np.vstack(boxes)
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuilds a model from the arrays returned by state().
+        """
+        model = cls.__new__(cls)
+        for name in ('x0', 'y0', 'dx', 'dy', 'length', 'start', 'reach'):
+            setattr(model, name, state[name])
+        model.length2 = np.where(model.length > 0, model.length ** 2, 1.)
+        model.total = np.concatenate(([0.], np.cumsum(model.length)[:-1]))
+        model.levels = []
+        while 'level_{}'.format(len(model.levels)) in state:
+            model.levels.append(tuple(state['level_{}'.format(len(model.levels))]))
+        return model
+
+    @property
+    def size(self):
+        return len(self.x0)
+
+    def build_index(self):
+        """
+        Builds the R-tree : consecutive segments of the axis are close to
+        each other, so the tree is packed by grouping NODE_CAPACITY
+        consecutive segments, then NODE_CAPACITY consecutive nodes, and so
+        on up to the root level.
+        """
+        x_min = np.minimum(self.x0, self.x0 + self.dx)
+        y_min = np.minimum(self.y0, self.y0 + self.dy)
+        x_max = np.maximum(self.x0, self.x0 + self.dx)
+        y_max = np.maximum(self.y0, self.y0 + self.dy)
+        self.levels = [(x_min, y_min, x_max, y_max)]
+        while len(self.levels[-1][0]) > self.NODE_CAPACITY:
+            starts = np.arange(0, len(self.levels[-1][0]), self.NODE_CAPACITY)
+            x_min, y_min, x_max, y_max = self.levels[-1]
+            self.levels.append((np.minimum.reduceat(x_min, starts),
+                                np.minimum.reduceat(y_min, starts),
+                                np.maximum.reduceat(x_max, starts),
+                                np.maximum.reduceat(y_max, starts)))
+
+    def locate(self, x, y, max_distance=None, tolerance=None):
+        """
+        Finds the nearest segment of each point (x, y). Returns the index
+        of the segment (-1 if no segment lies within max_distance), the
+        position of the projected point on it (from 0 to 1) and the
+        distance from the point to the axis. If a tolerance is given, the
+        curvilinear distance of the projected points may be wrong by up to
+        the tolerance (see search).
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        segment = np.full(len(x), -1, dtype=np.int64)
+        t = np.full(len(x), np.nan)
+        gap = np.full(len(x), np.nan)
+        for i in range(0, len(x), self.CHUNK_SIZE):
+            chunk = slice(i, i + self.CHUNK_SIZE)
+            segment[chunk], t[chunk], gap[chunk] = self.search(x[chunk], y[chunk], max_distance,
+                                                               tolerance=tolerance)
+        return segment, t, gap
+
+    def search(self, x, y, max_distance, tolerance=None):
+        """
+        Walks down the R-tree for a chunk of points. The pairs (point,
+        node) are pruned level by level with the smallest distance from the
+        point to the bounding box of the node, which can't exceed the
+        distance from the point to the first vertex of any other node.
+
+        The nodes of the upper levels are a coarse version of the axis : if
+        a tolerance is given, the search stops for a point as soon as its
+        remaining nodes hold a stretch of a single reach not longer than
+        twice the tolerance. The nearest segment lies in that stretch, so
+        its middle is within the tolerance of the exact curvilinear
+        distance. The returned distance to the axis is then the one to the
+        middle of the stretch.
+        """
+        count = len(x)
+        bound = np.full(count, np.inf if max_distance is None else max_distance ** 2, dtype=float)
+        # distance to the nearest vertex seen, to check max_distance before stopping early
+        upper = np.full(count, np.inf)
+        stopped = np.zeros(count, dtype=bool)
+        approximate = np.full(count, np.nan)
+        stretch_start = np.zeros(count, dtype=np.int64)
+        stretch_end = np.zeros(count, dtype=np.int64)
+
+        roots = len(self.levels[-1][0])
+        pairs_point = np.repeat(np.arange(count), roots)
+        pairs_node = np.tile(np.arange(roots), count)
+
+        for level in range(len(self.levels) - 1, 0, -1):
+            x_min, y_min, x_max, y_max = (array[pairs_node] for array in self.levels[level])
+            px, py = x[pairs_point], y[pairs_point]
+            near_x = np.maximum(np.maximum(x_min - px, px - x_max), 0.)
+            near_y = np.maximum(np.maximum(y_min - py, py - y_max), 0.)
+
+            # pairs are sorted by point : update the bound point by point
+            first = pairs_node * self.NODE_CAPACITY ** level
+            vertex = (self.x0[first] - px) ** 2 + (self.y0[first] - py) ** 2
+            starts = np.flatnonzero(np.diff(pairs_point, prepend=-1))
+            points = pairs_point[starts]
+            upper[points] = np.minimum(upper[points], np.minimum.reduceat(vertex, starts))
+            bound[points] = np.minimum(bound[points], upper[points])
+            kept = near_x ** 2 + near_y ** 2 <= bound[pairs_point]
+
+            if tolerance is not None and kept.any():
+                # stretch of segments covered by the remaining nodes of each point
+                kept_point, kept_node = pairs_point[kept], pairs_node[kept]
+                starts = np.flatnonzero(np.diff(kept_point, prepend=-1))
+                points = kept_point[starts]
+                low = np.minimum.reduceat(kept_node, starts) * self.NODE_CAPACITY ** level
+                high = np.minimum((np.maximum.reduceat(kept_node, starts) + 1) * self.NODE_CAPACITY ** level,
+                                  self.size) - 1
+                done = ((self.reach[low] == self.reach[high])
+                        & (self.total[high] + self.length[high] - self.total[low] <= 2 * tolerance)
+                        & (upper[points] <= (np.inf if max_distance is None else max_distance ** 2)))
+                points, low, high = points[done], low[done], high[done]
+                stopped[points] = True
+                approximate[points] = (self.total[low] + self.total[high] + self.length[high]) / 2
+                stretch_start[points], stretch_end[points] = low, high
+                kept &= ~stopped[pairs_point]
+
+            # replace the kept nodes by their children
+            children = len(self.levels[level - 1][0])
+            pairs_point = np.repeat(pairs_point[kept], self.NODE_CAPACITY)
+            pairs_node = (self.NODE_CAPACITY * pairs_node[kept][:, np.newaxis]
+                          + np.arange(self.NODE_CAPACITY)).ravel()
+            valid = pairs_node < children
+            pairs_point, pairs_node = pairs_point[valid], pairs_node[valid]
+
+        # exact distance to the remaining segments
+        px, py = x[pairs_point], y[pairs_point]
+        x0, y0 = self.x0[pairs_node], self.y0[pairs_node]
+        dx, dy = self.dx[pairs_node], self.dy[pairs_node]
+        t = np.clip(((px - x0) * dx + (py - y0) * dy) / self.length2[pairs_node], 0., 1.)
+        d2 = (x0 + t * dx - px) ** 2 + (y0 + t * dy - py) ** 2
+
+        # keep the nearest segment of each point
+        starts = np.flatnonzero(np.diff(pairs_point, prepend=-1))
+        group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(d2))))
+        hits = np.flatnonzero(d2 == np.minimum.reduceat(d2, starts)[group])
+        nearest = hits[np.diff(group[hits], prepend=-1) != 0]
+        nearest = nearest[d2[nearest] <= bound[pairs_point[nearest]]]
+
+        segment = np.full(count, -1, dtype=np.int64)
+        position = np.full(count, np.nan)
+        gap = np.full(count, np.nan)
+        segment[pairs_point[nearest]] = pairs_node[nearest]
+        position[pairs_point[nearest]] = t[nearest]
+        gap[pairs_point[nearest]] = np.sqrt(d2[nearest])
+
+        # segment and position of the middle of the stretches
+        points = np.flatnonzero(stopped)
+        if len(points):
+            middle = approximate[points]
+            found = np.clip(np.searchsorted(self.total, middle, side='right') - 1,
+                            stretch_start[points], stretch_end[points])
+            t = np.clip((middle - self.total[found]) / np.where(self.length[found] > 0, self.length[found], 1.),
+                        0., 1.)
+            segment[points], position[points] = found, t
+            gap[points] = np.hypot(self.x0[found] + t * self.dx[found] - x[points],
+                                   self.y0[found] + t * self.dy[found] - y[points])
+        return segment, position, gap
+
+    def snap(self, x, y, max_distance=None, tolerance=None):
+        """
+        Orthogonal projection of the points (x, y) onto the axis. Returns
+        the curvilinear distance of the projected points, their coordinates
+        and the signed distance from the points to the axis (positive on
+        the left of the axis), all NaN for points farther than
+        max_distance, and the key of the nearest reach (-1 for these
+        points). If a tolerance is given, the curvilinear distances may be
+        wrong by up to the tolerance, the projected points and the offsets
+        following them.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        segment, t, gap = self.locate(x, y, max_distance, tolerance)
+        found = segment >= 0
+        k = segment[found]
+        dist, snapped_x, snapped_y, offset = (np.full(len(segment), np.nan) for _ in range(4))
+        dist[found] = self.start[k] + t[found] * self.length[k]
+        snapped_x[found] = self.x0[k] + t[found] * self.dx[k]
+        snapped_y[found] = self.y0[k] + t[found] * self.dy[k]
+        side = self.dx[k] * (y[found] - snapped_y[found]) - self.dy[k] * (x[found] - snapped_x[found])
+        offset[found] = np.where(side < 0, -gap[found], gap[found])
+        reach = np.full(len(segment), -1, dtype=np.int64)
+        reach[found] = self.reach[k]
+        return dist, snapped_x, snapped_y, offset, reach
+
+
+class CorridorGrid:
+    """
+    Coarse uniform grid over the corridor of a given width around the
+    axis. A cell is marked if it may contain a point closer to the axis
+    than the width, so that points lying in unmarked cells can be rejected
+    before any distance to the axis is computed.
+    """
+
+    # maximum number of cells of the grid
+    MAX_CELLS = 4 * 1024 ** 2
+
+    def __init__(self, axis, width):
+        self.width = width
+        x_min, y_min, x_max, y_max = (function(array) for function, array in
+                                      zip((np.min, np.min, np.max, np.max), axis.levels[-1]))
+        self.x_min = x_min - width
+        self.y_min = y_min - width
+        self.cell = max(width, 1e-9)
+        while ((x_max - x_min + 2 * width) / self.cell + 1) * ((y_max - y_min + 2 * width) / self.cell + 1) > self.MAX_CELLS:
+            self.cell *= 2
+        self.cols = int((x_max - x_min + 2 * width) / self.cell) + 1
+        self.rows = int((y_max - y_min + 2 * width) / self.cell) + 1
+        self.mask = np.zeros((self.rows, self.cols), dtype=bool)
+
+        # sample the segments every half cell, then mark the cells around
+        # each sample which may hold points within the width of it
+        spacing = self.cell / 2
+        steps = np.maximum(np.ceil(axis.length / spacing).astype(np.int64), 1)
+        segment = np.repeat(np.arange(axis.size), steps + 1)
+        t = np.arange(len(segment)) - np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1)
+        t = t / np.repeat(steps, steps + 1)
+        col = ((axis.x0[segment] + t * axis.dx[segment] - self.x_min) / self.cell).astype(np.int64)
+        row = ((axis.y0[segment] + t * axis.dy[segment] - self.y_min) / self.cell).astype(np.int64)
+        reach = int(np.ceil((width + spacing) / self.cell))
+        for shift_row in range(-reach, reach + 1):
+            for shift_col in range(-reach, reach + 1):
+                self.mask[np.clip(row + shift_row, 0, self.rows - 1),
+                          np.clip(col + shift_col, 0, self.cols - 1)] = True
+
+    def contains(self, x, y):
+        """
+        Returns False for the points (x, y) which are farther than the
+        width from the axis, True for the others (which may still be
+        farther).
+        """
+        col = np.floor((np.asarray(x) - self.x_min) / self.cell).astype(np.int64)
+        row = np.floor((np.asarray(y) - self.y_min) / self.cell).astype(np.int64)
+        inside = (col >= 0) & (col < self.cols) & (row >= 0) & (row < self.rows)
+        inside[inside] = self.mask[row[inside], col[inside]]
+        return inside
+
+
+class ThinningGrid:
+    """
+    Uniform grid of square cells thinning dense point clouds : a single
+    point is kept per cell, the lowest one, the highest one or the one
+    closest to the center of the cell. The grid is aligned on the origin
+    of the coordinates, so that it does not depend on the extent of the
+    points.
+    """
+
+    LOWEST, HIGHEST, CENTER = range(3)
+
+    def __init__(self, cell, mode=LOWEST):
+        self.cell = cell
+        self.mode = mode
+
+    def select(self, x, y, z):
+        """
+        Returns the sorted indexes of the points (x, y, z) kept, one per
+        cell. Points without Z value come after the others of their cell
+        when the lowest or highest point is kept.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if len(x) == 0:
+            return np.empty(0, dtype=np.int64)
+        col = np.floor(x / self.cell).astype(np.int64)
+        row = np.floor(y / self.cell).astype(np.int64)
+        if self.mode == self.CENTER:
+            rank = (x - (col + .5) * self.cell) ** 2 + (y - (row + .5) * self.cell) ** 2
+        else:
+            rank = np.asarray(z, dtype=float) * (1. if self.mode == self.LOWEST else -1.)
+            rank = np.where(np.isnan(rank), np.inf, rank)
+        # the first point of each cell once sorted by cell then by rank
+        order = np.lexsort((rank, row, col))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (np.diff(col[order]) != 0) | (np.diff(row[order]) != 0)
+        return np.sort(order[first])
+
+
+class AxisCache:
+    """
+    On-disk cache of the axis models, so that the axis is prepared only
+    once when it is used for many projected layers. A model is identified
+    by the source of the axis layer, the modification time of its file and
+    the options used to build it. The least recently used models are
+    evicted when the cache exceeds MAX_SIZE bytes.
+    """
+
+    MAX_SIZE = 512 * 1024 ** 2
+
+    # to be increased whenever the AxisModel attributes change
+    VERSION = 2
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(QgsApplication.qgisSettingsDirPath(), 'cache', 'onf-rtm-tools', 'axis')
+        self.directory = directory
+
+    def key(self, layer, *options):
+        """
+        Returns the cache key of a layer, None if it can't be cached (no
+        file behind it or unsaved changes).
+        """
+        path = layer.source().split('|')[0]
+        if not os.path.isfile(path) or layer.isModified():
+            return None
+        items = (self.VERSION, layer.source(), os.path.getmtime(path))
+        # the edits of a GeoPackage in WAL mode stay in its sidecar file until a checkpoint
+        wal = path + '-wal'
+        if os.path.isfile(wal):
+            items += (os.path.getmtime(wal), os.path.getsize(wal))
+        identity = '|'.join(str(item) for item in items + options)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def load(self, key):
+        path = os.path.join(self.directory, key + '.npz')
+        try:
+            with np.load(path) as arrays:
+                model = AxisModel.from_state(arrays)
+        except (OSError, ValueError, KeyError):
+            return None
+        # mark the model as recently used
+        os.utime(path)
+        return model
+
+    def save(self, key, model):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key + '.npz')
+        with open(path + '.tmp', 'wb') as file:
+            np.savez(file, **model.state())
+        os.replace(path + '.tmp', path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                status = os.stat(os.path.join(self.directory, name))
+                entries.append((status.st_mtime, status.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.MAX_SIZE:
+                break
+            os.remove(os.path.join(self.directory, name))
+            size -= entry_size
+
+    def get(self, layer, invert, feedback=None, reach_field=None):
+        """
+        Returns the axis model of a layer, from the cache if possible.
+        """
+        key = self.key(layer, invert, reach_field)
+        if key is not None:
+            model = self.load(key)
+            if model is not None:
+                if feedback is not None:
+                    feedback.pushInfo('Axis model read from the cache')
+                return model
+        model = AxisModel.from_layer(layer, invert, reach_field)
+        if key is not None:
+            try:
+                self.save(key, model)
+            except OSError:
+                if feedback is not None:
+                    feedback.reportError('Unable to write the axis model in the cache')
+        return model
+
+
+class RasterSampler:
+    """
+    Vectorized sampling of a raster band : the points are grouped by
+    tiles of the raster, each tile being read once as a NumPy array. The
+    value of the cell containing each point is returned, NaN where the
+    point is outside the raster or on a no data cell. Data providers are
+    not thread safe, so each thread reads the raster through its own
+    clone of the provider.
+    """
+
+    DATA_TYPES = {Qgis.Byte: np.uint8,
+                  Qgis.UInt16: np.uint16,
+                  Qgis.Int16: np.int16,
+                  Qgis.UInt32: np.uint32,
+                  Qgis.Int32: np.int32,
+                  Qgis.Float32: np.float32,
+                  Qgis.Float64: np.float64}
+
+    TILE_SIZE = 1024
+
+    def __init__(self, raster_layer, band):
+        self.source_provider = raster_layer.dataProvider()
+        self.local = threading.local()
+        self.band = band
+        self.extent = raster_layer.extent()
+        self.width = raster_layer.width()
+        self.height = raster_layer.height()
+        self.cell_x = self.extent.width() / self.width
+        self.cell_y = self.extent.height() / self.height
+        self.dtype = self.DATA_TYPES.get(self.source_provider.dataType(band), np.float64)
+        self.nodata = None
+        if self.source_provider.sourceHasNoDataValue(band) and self.source_provider.useSourceNoDataValue(band):
+            self.nodata = self.source_provider.sourceNoDataValue(band)
+
+    @property
+    def provider(self):
+        if threading.current_thread() is threading.main_thread():
+            return self.source_provider
+        if not hasattr(self.local, 'provider'):
+            self.local.provider = self.source_provider.clone()
+        return self.local.provider
+
+    def sample(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        values = np.full(len(x), np.nan)
+
+        col = np.floor((x - self.extent.xMinimum()) / self.cell_x).astype(np.int64)
+        row = np.floor((self.extent.yMaximum() - y) / self.cell_y).astype(np.int64)
+        inside = (col >= 0) & (col < self.width) & (row >= 0) & (row < self.height)
+
+        # group the points by tile
+        indexes = np.flatnonzero(inside)
+        tiles = (row[indexes] // self.TILE_SIZE) * (self.width // self.TILE_SIZE + 1) \
+            + col[indexes] // self.TILE_SIZE
+        order = np.argsort(tiles, kind='stable')
+        indexes, tiles = indexes[order], tiles[order]
+        bounds = np.flatnonzero(np.diff(tiles)) + 1
+
+        for selection in np.split(indexes, bounds):
+            if len(selection) == 0:
+                continue
+            col_min, col_max = col[selection].min(), col[selection].max()
+            row_min, row_max = row[selection].min(), row[selection].max()
+            block = self.read(col_min, row_min, col_max - col_min + 1, row_max - row_min + 1)
+            values[selection] = block[row[selection] - row_min, col[selection] - col_min]
+
+        return values
+
+    def read(self, col, row, cols, rows):
+        """
+        Reads a window of the raster band as a NumPy array.
+        """
+        x_min = self.extent.xMinimum() + col * self.cell_x
+        y_max = self.extent.yMaximum() - row * self.cell_y
+        extent = QgsRectangle(x_min, y_max - rows * self.cell_y, x_min + cols * self.cell_x, y_max)
+        block = self.provider.block(self.band, extent, int(cols), int(rows))
+        data = np.frombuffer(bytes(block.data()), dtype=self.dtype).reshape(int(rows), int(cols))
+        data = data.astype(float)
+        if self.nodata is not None:
+            data[data == self.nodata] = np.nan
+        return data
+
+
+class LayerSink:
+    """
+    Feature sink appending the output features to an existing layer
+    (incremental mode). The provider fields may hold primary key fields
+    (like the 'fid' of GeoPackages) which are not output fields, so the
+    attributes are placed by name and the primary keys are left null.
+    """
+
+    def __init__(self, layer, fields):
+        self.provider = layer.dataProvider()
+        self.fields = self.provider.fields()
+        self.indexes = [self.fields.indexOf(name) for name in fields.names()]
+
+    def addFeatures(self, features, flags=None):
+        layer_features = []
+        for feature in features:
+            layer_feature = QgsFeature(self.fields)
+            layer_feature.setGeometry(feature.geometry())
+            attributes = [None] * self.fields.count()
+            for index, value in zip(self.indexes, feature.attributes()):
+                attributes[index] = value
+            layer_feature.setAttributes(attributes)
+            layer_features.append(layer_feature)
+        return self.provider.addFeatures(layer_features)
+
+
+class PointProjector:
+    """
+    Projection of batches of points onto the axis, shared by the workers
+    of the native engine. Builds the output features : the kept fields
+    followed by 'dist', 'Z' and, if asked, 'offset' and 'rank'. The curvilinear
+    distance can also be stored as the M value of the geometries, and the
+    projected points on the axis can be returned as a second set of
+    features.
+    """
+
+    def __init__(self, axis, sampler=None, max_distance=None, drop_out_of_range=False, corridor=None):
+        self.axis = axis
+        self.sampler = sampler
+        self.max_distance = max_distance
+        self.drop_out_of_range = drop_out_of_range
+        self.corridor = corridor
+        if corridor is not None and (max_distance is None or corridor.width < max_distance):
+            self.max_distance = corridor.width
+        self.kept_indexes = []
+        self.fields = QgsFields()
+        self.delimiter = None
+        self.output_m = False
+        self.add_offset = False
+        self.snapped = False
+        self.reach_field = None
+        self.reach_ids = {}
+        # maximum error allowed on the curvilinear distances, None for exact ones
+        self.tolerance = None
+        # transforms from the CRS of the points to the ones of the axis and of the DTM
+        self.axis_transform = None
+        self.dtm_transform = None
+        # record the id and the hash of the source features for incremental updates
+        self.track = False
+        # record the position of the features in the sorted output
+        self.ranked = False
+
+    def add_fields(self):
+        """
+        Appends the fields computed by the projection to the kept fields.
+        """
+        if self.track:
+            self.fields.append(QgsField('src_fid', QVariant.LongLong))
+            self.fields.append(QgsField('src_hash', QVariant.String, len=40))
+        if self.reach_field is not None:
+            field = QgsField(self.reach_field)
+            field.setName('reach')
+            self.fields.append(field)
+        self.fields.append(QgsField('dist', QVariant.Double, len=10, prec=3))
+        self.fields.append(QgsField('Z', QVariant.Double, len=10, prec=3))
+        if self.add_offset:
+            self.fields.append(QgsField('offset', QVariant.Double, len=10, prec=3))
+        if self.ranked:
+            self.fields.append(QgsField('rank', QVariant.LongLong))
+
+    def project_coordinates(self, x, y, z):
+        """
+        Returns the curvilinear distance, the Z value, the coordinates of
+        the projected points, the signed offset and the nearest reach of
+        the points (x, y, z), Z being sampled from the DTM if any. Points
+        outside the corridor are rejected before being projected. The
+        projected points are in the CRS of the axis.
+        """
+        axis_x, axis_y = transform_coordinates(self.axis_transform, x, y)
+        inside = np.ones(len(x), dtype=bool)
+        if self.corridor is not None:
+            inside = self.corridor.contains(axis_x, axis_y)
+
+        if self.sampler is not None:
+            # points which are going to be dropped are not sampled
+            sampled = inside if self.drop_out_of_range else slice(None)
+            z = np.full(len(x), np.nan)
+            z[sampled] = self.sampler.sample(*transform_coordinates(self.dtm_transform, x[sampled], y[sampled]))
+            # like native:setzfromraster, no data cells give a zero Z value
+            z[np.isnan(z)] = 0.
+
+        dist, snapped_x, snapped_y, offset = (np.full(len(x), np.nan) for _ in range(4))
+        reach = np.full(len(x), -1, dtype=np.int64)
+        dist[inside], snapped_x[inside], snapped_y[inside], offset[inside], reach[inside] = \
+            self.axis.snap(axis_x[inside], axis_y[inside], self.max_distance, tolerance=self.tolerance)
+        return dist, z, snapped_x, snapped_y, offset, reach
+
+    def output(self, attributes, geometry, current, dist, z, snapped_x, snapped_y, offset, reach, rank=None):
+        """
+        Returns the output feature of a projected point and, if asked, the
+        corresponding point on the axis. rank is the rank of the first
+        point of the batch in the sorted output.
+        """
+        if self.output_m:
+            geometry.get().dropMValue()
+            geometry.get().addMValue(float(dist[current]))
+
+        if self.reach_field is not None:
+            attributes = attributes + [self.reach_ids.get(int(reach[current]))]
+        attributes = attributes + [None if np.isnan(dist[current]) else float(dist[current]),
+                                   None if np.isnan(z[current]) else float(z[current])]
+        if self.add_offset:
+            attributes.append(None if np.isnan(offset[current]) else float(offset[current]))
+        if self.ranked:
+            attributes.append(rank + current)
+
+        output_feature = QgsFeature(self.fields)
+        output_feature.setGeometry(geometry)
+        output_feature.setAttributes(attributes)
+
+        snapped_feature = None
+        if self.snapped and not np.isnan(dist[current]):
+            snapped_point = QgsPoint(snapped_x[current], snapped_y[current])
+            if self.output_m:
+                snapped_point.addMValue(float(dist[current]))
+            snapped_feature = QgsFeature(self.fields)
+            snapped_feature.setGeometry(QgsGeometry(snapped_point))
+            snapped_feature.setAttributes(attributes)
+
+        return output_feature, snapped_feature
+
+    def project_features(self, features, rank=None):
+        """
+        Projects a batch of features, the first one having the given rank
+        in the sorted output. Returns the output features and the projected
+        points on the axis.
+        """
+        features = [feature for feature in features if feature.hasGeometry()]
+        vertices = [feature.geometry().vertexAt(0) for feature in features]
+        x = np.array([vertex.x() for vertex in vertices], dtype=float)
+        y = np.array([vertex.y() for vertex in vertices], dtype=float)
+        z = np.array([vertex.z() for vertex in vertices], dtype=float)
+        results = self.project_coordinates(x, y, z)
+        dist = results[0]
+
+        output_features, snapped_features = [], []
+        for current, feature in enumerate(features):
+            if self.drop_out_of_range and np.isnan(dist[current]):
+                continue
+
+            geometry = feature.geometry()
+            if self.sampler is not None:
+                geometry.get().dropZValue()
+                geometry.get().addZValue(float(results[1][current]))
+
+            attributes = feature.attributes()
+            attributes = [attributes[index] for index in self.kept_indexes]
+            if self.track:
+                attributes += [feature.id(), feature_hash(feature, attributes)]
+            output_feature, snapped_feature = self.output(attributes, geometry, current, *results, rank=rank)
+            output_features.append(output_feature)
+            if snapped_feature is not None:
+                snapped_features.append(snapped_feature)
+
+        return output_features, snapped_features
+
+    def chainage(self, x, y):
+        """
+        Returns the curvilinear distance and the nearest reach of the
+        points (x, y) alone, NaN and -1 for the points outside the corridor
+        or the search distance.
+        """
+        x, y = transform_coordinates(self.axis_transform, x, y)
+        inside = np.ones(len(x), dtype=bool)
+        if self.corridor is not None:
+            inside = self.corridor.contains(x, y)
+        dist = np.full(len(x), np.nan)
+        reach = np.full(len(x), -1, dtype=np.int64)
+        results = self.axis.snap(x[inside], y[inside], self.max_distance, tolerance=self.tolerance)
+        dist[inside], reach[inside] = results[0], results[4]
+        return dist, reach
+
+    def parse_lines(self, lines):
+        """
+        Returns the X, Y and Z coordinates read from a batch of lines of a
+        XYZ file, as a (n, 3) array.
+        """
+        if not lines:
+            return np.empty((0, 3))
+        try:
+            return np.loadtxt(lines, delimiter=self.delimiter, usecols=(0, 1, 2), ndmin=2)
+        except ValueError as error:
+            raise QgsProcessingException('Unable to read the XYZ file : {}'.format(error))
+
+    def project_lines(self, lines):
+        """
+        Parses a batch of lines of a XYZ file and projects the points.
+        Returns the output features and the projected points on the axis.
+        """
+        return self.project_xyz(self.parse_lines(lines))
+
+    def project_xyz(self, xyz, rank=None):
+        """
+        Projects the points of a (n, 3) array of coordinates, the first one
+        having the given rank in the sorted output. Returns the output
+        features and the projected points on the axis.
+        """
+        x, y = xyz[:, 0], xyz[:, 1]
+        results = self.project_coordinates(x, y, xyz[:, 2].copy())
+        dist, z = results[0], results[1]
+
+        output_features, snapped_features = [], []
+        for current in range(len(x)):
+            if self.drop_out_of_range and np.isnan(dist[current]):
+                continue
+            geometry = QgsGeometry(QgsPoint(x[current], y[current], z[current]))
+            output_feature, snapped_feature = self.output([], geometry, current, *results, rank=rank)
+            output_features.append(output_feature)
+            if snapped_feature is not None:
+                snapped_features.append(snapped_feature)
+
+        return output_features, snapped_features
 
 
 class PointProjection(QgsProcessingAlgorithm):
@@ -31,6 +931,9 @@ class PointProjection(QgsProcessingAlgorithm):
     Here is the class documentation.
     """
 
+    # number of consecutive output features described by a line of the chainage index
+    INDEX_BLOCK_SIZE = 1000
+
     def tr(self, string):
         """
         Returns a translatable string with the self.tr() function.
@@ -73,13 +976,35 @@ class PointProjection(QgsProcessingAlgorithm):
         <h2>Description<\h2>
         <p>Orthogonal projection of a point layer onto a line or multiline vector layer.<\p>
         <h2>Inputs<\h2>
-        <p>Axis layer : Should contain a single line or multiline feature onto which points will be projected.<\p>
-        <p>Projected layer : Point layer to be projected.<\p>
+        <p>Axis layer : Should contain a single line or multiline feature onto which points will be projected, or one feature per reach of a network if a reach ID field is provided.<\p>
+        <p>Reach ID field : If provided, the axis layer is a network of reaches, the features sharing the same ID being chained into one reach in the order in which they are stored. Each point is projected onto its nearest reach, whose ID is stored in a field 'reach', and 'dist' is measured from the start of that reach. Inverting the axis reverses every reach (native engine only).<\p>
+        <p>Projected layer : Point layer to be projected. If its CRS differs from the one of the axis layer or of the DTM, its coordinates are transformed on the fly, without any reprojected copy of the layer (native engine only). Output points keep the CRS of the projected layer, projected points on the axis get the CRS of the axis layer.<\p>
+        <p>Projected XYZ file : Instead of the projected layer, a text file whose lines start with the X, Y and Z coordinates of the points to be projected. It is read by batches, without being loaded as a layer (native engine only).<\p>
+        <p>XYZ file delimiter : Character separating the columns of the XYZ file. If empty, columns are separated by blanks.<\p>
+        <p>XYZ file header lines : Number of lines to skip at the beginning of the XYZ file.<\p>
+        <p>XYZ file CRS : CRS of the XYZ file coordinates. If not provided, the axis layer CRS is used.<\p>
         <p>Fields to keep : Fields from the projected layer to be kept in the output layer.<\p>
         <p>Digital Terrain Model (DTM) : If provided, point layer features' Z value will be extracted from it. Else, the algorithm will try to extract the Z value of the point layer features' geometry.<\p>
+        <p>Maximum search distance : If provided, points farther than this distance from the axis are not projected. Their 'dist' value is left empty, unless they are dropped.<\p>
+        <p>Corridor width : If provided, points farther than this distance from the axis are rejected by a coarse grid around the axis before being projected, which speeds up layers covering much more than the axis surroundings. They are handled as points farther than the maximum search distance (native engine only).<\p>
+        <p>Maximum curvilinear distance error : If provided, 'dist' is approximate, within this error of the exact value. The nodes of the spatial index over the axis are a coarse version of it : the search stops as soon as the nearest segment is known to lie in a stretch of the axis not longer than twice the error, and 'dist' is the middle of that stretch. Errors of several times the length of the axis segments make the projection faster, for previews. Projected points on the axis and offsets are approximate as well (native engine only).<\p>
+        <p>Drop points farther than the maximum search distance : self-explained (native engine only).<\p>
+        <p>Thinning cell size : If provided, the projected points are gridded in square cells of this size (in the CRS of the axis layer) and a single point is kept per cell, before any projection or DTM sampling. The points are read a first time to choose the kept ones, then only these are projected (native engine only).<\p>
+        <p>Point kept per cell : The lowest point, the highest one (according to the Z value of the points themselves, not the one of the DTM), or the point closest to the center of the cell.<\p>
+        <p>Store the curvilinear distance as M value : If checked, output geometries get a M value equal to 'dist' (native engine only).<\p>
+        <p>Add the signed offset from the axis : If checked, a field 'offset' gives the distance from the point to the axis, positive on the left of the axis and negative on its right (native engine only).<\p>
+        <p>Projection engine : 'Native' computes the projection in QGIS itself (the parts of a multiline axis are chained in their storage order). 'GRASS v.distance' is the former behaviour and requires GRASS.<\p>
+        <p>Use the axis cache : If checked, the prepared axis is stored on disk and reused by the next runs on the same axis layer, as long as its file is not modified (native engine only).<\p>
+        <p>Batch size : Number of features read, projected and written at once by the native engine. Memory use depends on it, not on the size of the projected layer.<\p>
+        <p>Number of parallel workers : Number of batches projected at the same time by the native engine. Up to the number of cores of the computer.<\p>
+        <p>Sort the output by curvilinear distance : If checked, output features are written by increasing 'dist' (reach by reach with a reach ID field), points without 'dist' coming last. The curvilinear distances are computed in a first pass, then the points are read again in that order (native engine only).<\p>
+        <p>Record the projected features for incremental updates : If checked, two fields 'src_fid' and 'src_hash' store the id of the source feature and a hash of its geometry and kept fields, so that the output can be updated by the next runs (native engine only).<\p>
+        <p>Previous output layer to update : Incremental mode. An output layer produced with the same options and with recorded features. Only the features of the projected layer which were added or modified since are projected, the outputs of the modified and removed features are deleted, and the previous output layer is updated in place instead of writing the output layer. Projected points on the axis are only written for the projected features (native engine only).<\p>
         <p><\p>
         <h2>Output<\h2>
         <p>The output layer is a copy of the projected layer provided whose attribute table contains a new field 'dist' which corresponds to the curvilinear distance of the projected points onto the axis.<\p>
+        <p>Projected points on the axis : If set, the feet of the perpendiculars from the points to the axis, with the same attributes as the output layer (native engine only).<\p>
+        <p>Chainage index : If set, the output is sorted by curvilinear distance and a CSV file is written next to it. Each line describes a block of consecutive output features : 'dist_min', 'dist_max', then 'first' and 'last', the 'rank' of the first and last features of the block. The output then gets a field 'rank', the position of each feature in the sorted output starting from 0, which does not depend on the feature ids of the output format. With a reach ID field, the output is sorted by reach then by 'dist' and each line starts with the 'reach' of its block. The ranks of the points within a range of 'dist' are found by a binary search on this file, then these points are fetched with a filter on 'rank', like "rank" BETWEEN first AND last (native engine only).<\p>
         <\body><\html>
         """
         return self.tr(help)
@@ -106,11 +1031,57 @@ class PointProjection(QgsProcessingAlgorithm):
             )
         )
         
+        self.addParameter(
+            QgsProcessingParameterField(
+                'AXIS_ID_FIELD',
+                self.tr('Reach ID field'),
+                optional=True,
+                parentLayerParameterName='AXIS_LAYER'
+            )
+        )
+        
         self.addParameter(
             QgsProcessingParameterVectorLayer(
                 'PROJECTED_LAYER',
                 self.tr('Projected layer'),
-                [QgsProcessing.TypeVectorPoint]
+                [QgsProcessing.TypeVectorPoint],
+                optional=True
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterFile(
+                'XYZ_FILE',
+                self.tr('Projected XYZ file'),
+                fileFilter='XYZ files (*.xyz *.txt *.csv);;All files (*.*)',
+                optional=True
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterString(
+                'XYZ_DELIMITER',
+                self.tr('XYZ file delimiter'),
+                defaultValue='',
+                optional=True
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'XYZ_HEADER_LINES',
+                self.tr('XYZ file header lines'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterCrs(
+                'XYZ_CRS',
+                self.tr('XYZ file CRS'),
+                optional=True
             )
         )
         
@@ -142,6 +1113,145 @@ class PointProjection(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'MAX_DISTANCE',
+                self.tr('Maximum search distance'),
+                defaultValue=None,
+                parentParameterName='AXIS_LAYER',
+                minValue=0,
+                optional=True
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'CORRIDOR_WIDTH',
+                self.tr('Corridor width'),
+                defaultValue=None,
+                parentParameterName='AXIS_LAYER',
+                minValue=0,
+                optional=True
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'CHAINAGE_TOLERANCE',
+                self.tr('Maximum curvilinear distance error'),
+                defaultValue=None,
+                parentParameterName='AXIS_LAYER',
+                minValue=0,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'DROP_OUT_OF_RANGE',
+                self.tr('Drop points farther than the maximum search distance'),
+                False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'THINNING_CELL',
+                self.tr('Thinning cell size'),
+                defaultValue=None,
+                parentParameterName='AXIS_LAYER',
+                minValue=0,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                'THINNING_MODE',
+                self.tr('Point kept per cell'),
+                options=[self.tr('Lowest point'), self.tr('Highest point'), self.tr('Closest to the cell center')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'OUTPUT_M',
+                self.tr('Store the curvilinear distance as M value'),
+                False
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'ADD_OFFSET',
+                self.tr('Add the signed offset from the axis'),
+                False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                'ENGINE',
+                self.tr('Projection engine'),
+                options=[self.tr('Native'), self.tr('GRASS v.distance')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'USE_CACHE',
+                self.tr('Use the axis cache'),
+                True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'BATCH_SIZE',
+                self.tr('Batch size'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=100000,
+                minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'WORKERS',
+                self.tr('Number of parallel workers'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'SORT_BY_DIST',
+                self.tr('Sort the output by curvilinear distance'),
+                False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'TRACK_FEATURES',
+                self.tr('Record the projected features for incremental updates'),
+                False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                'PREVIOUS_OUTPUT',
+                self.tr('Previous output layer to update'),
+                [QgsProcessing.TypeVectorPoint],
+                optional=True
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 'OUTPUT',
@@ -149,70 +1259,439 @@ class PointProjection(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                'SNAPPED',
+                self.tr('Projected points on the axis'),
+                QgsProcessing.TypeVectorPoint,
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                'CHAINAGE_INDEX',
+                self.tr('Chainage index'),
+                fileFilter='CSV files (*.csv)',
+                optional=True,
+                createByDefault=False
+            )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
         
         axis_layer = self.parameterAsVectorLayer(parameters, 'AXIS_LAYER', context)
-        
-        # delete all fields from AXIS_LAYER's attribute table
-        fields = []
-        for field in axis_layer.fields():
-            fields.append(field.name())
-            
-        axis_layer = processing.run("qgis:deletecolumn",
-                                    {'INPUT':axis_layer,
-                                     'COLUMN':fields,
-                                     'OUTPUT':'TEMPORARY_OUTPUT'},
-                                    is_child_algorithm=True,
-                                    context=context,
-                                    feedback=feedback)['OUTPUT']
-                                     
-        
         invert_axis = self.parameterAsBool(parameters, 'INVERT_AXIS', context)
+        projected_layer = self.parameterAsVectorLayer(parameters, 'PROJECTED_LAYER', context)
+        dtm = self.parameterAsRasterLayer(parameters, 'DTM', context)
+        engine = self.parameterAsEnum(parameters, 'ENGINE', context)
         
-        # if asked, invert the direction of the axis' line or polyline
-        if invert_axis:
-            axis_layer = processing.run("native:reverselinedirection",
-                                        {'INPUT':axis_layer,
-                                         'OUTPUT':'TEMPORARY_OUTPUT'},
-                                        is_child_algorithm=True,
-                                        context=context,
-                                        feedback=feedback)['OUTPUT']
-        
-        projected_layer = self.parameterAsVectorLayer(parameters, 'PROJECTED_LAYER', context)        
+        max_distance = None
+        if parameters.get('MAX_DISTANCE') is not None:
+            max_distance = self.parameterAsDouble(parameters, 'MAX_DISTANCE', context)
         
+        if engine == 1 and projected_layer is None:
+            raise QgsProcessingException(self.tr('The GRASS engine requires a projected layer'))
+        if engine == 1 and self.parameterAsFields(parameters, 'AXIS_ID_FIELD', context):
+            raise QgsProcessingException(self.tr('The GRASS engine does not support a reach field'))
+        if engine == 1 and parameters.get('PREVIOUS_OUTPUT') is not None:
+            raise QgsProcessingException(self.tr('The GRASS engine can not update a previous output layer'))
+        if engine == 1 and parameters.get('SNAPPED') is not None:
+            raise QgsProcessingException(self.tr('The GRASS engine can not write the projected points on the axis'))
+        if engine == 1 and (parameters.get('CHAINAGE_INDEX') is not None
+                            or self.parameterAsBool(parameters, 'SORT_BY_DIST', context)):
+            raise QgsProcessingException(self.tr('The GRASS engine can not sort the output'))
+        if engine == 1 and self.parameterAsBool(parameters, 'TRACK_FEATURES', context):
+            raise QgsProcessingException(self.tr('The GRASS engine can not record the projected features'))
+
+        if engine == 0:
+            projected_layer, snapped_layer, chainage_index = self.nativeProjection(axis_layer, invert_axis,
+                                                                                   projected_layer, dtm, max_distance,
+                                                                                   parameters, context, feedback)
+        else:
+            projected_layer = self.grassProjection(axis_layer, invert_axis, projected_layer, dtm,
+                                                   max_distance, parameters, context, feedback)
+            snapped_layer, chainage_index = None, None
+
+        # return the results of the algorithm
+        results = {'OUTPUT':projected_layer}
+        if snapped_layer is not None:
+            results['SNAPPED'] = snapped_layer
+        if chainage_index is not None:
+            results['CHAINAGE_INDEX'] = chainage_index
+        return results
+
+    def nativeProjection(self, axis_layer, invert_axis, projected_layer, dtm, max_distance, parameters, context, feedback):
+        """
+        Single pass over the projected points (layer features or lines of
+        a XYZ file) : each point is read once, its Z value is sampled and
+        its curvilinear distance is computed with the native engine before
+        being written to the output sink, batch after batch.
+        """
+        # with a reach ID field, the features of the axis layer sharing an ID are a reach
+        reach_fields = self.parameterAsFields(parameters, 'AXIS_ID_FIELD', context)
+        by_reach = bool(reach_fields)
+        reach_field = reach_fields[0] if by_reach else None
+        if self.parameterAsBool(parameters, 'USE_CACHE', context):
+            axis = AxisCache().get(axis_layer, invert_axis, feedback, reach_field)
+        else:
+            axis = AxisModel.from_layer(axis_layer, invert_axis, reach_field)
+
+        sampler = None
+        if dtm is not None:
+            sampler = RasterSampler(dtm, parameters['DTM_BAND'])
+
+        corridor = None
+        if parameters.get('CORRIDOR_WIDTH') is not None:
+            corridor = CorridorGrid(axis, self.parameterAsDouble(parameters, 'CORRIDOR_WIDTH', context))
+
+        projector = PointProjector(axis, sampler, max_distance,
+                                   self.parameterAsBool(parameters, 'DROP_OUT_OF_RANGE', context),
+                                   corridor)
+        if parameters.get('CHAINAGE_TOLERANCE') is not None:
+            projector.tolerance = self.parameterAsDouble(parameters, 'CHAINAGE_TOLERANCE', context)
+        projector.output_m = self.parameterAsBool(parameters, 'OUTPUT_M', context)
+        projector.add_offset = self.parameterAsBool(parameters, 'ADD_OFFSET', context)
+        projector.snapped = parameters.get('SNAPPED') is not None
+        if by_reach:
+            # the model knows the reaches by their key
+            projector.reach_field = axis_layer.fields().at(axis_layer.fields().indexOf(reach_field))
+            projector.reach_ids = reach_keys(axis_layer, reach_field)[1]
+        batch_size = self.parameterAsInt(parameters, 'BATCH_SIZE', context)
+        xyz_file = self.parameterAsFile(parameters, 'XYZ_FILE', context)
+
+        chainage_index = None
+        if parameters.get('CHAINAGE_INDEX') is not None:
+            chainage_index = self.parameterAsFileOutput(parameters, 'CHAINAGE_INDEX', context)
+        # the chainage index only makes sense for a sorted output
+        sort_by_dist = self.parameterAsBool(parameters, 'SORT_BY_DIST', context) or bool(chainage_index)
+        # the chainage index refers to the features by their rank
+        projector.ranked = bool(chainage_index)
+        sorted_dist, sorted_reach = None, None
+
+        thinning = None
+        if parameters.get('THINNING_CELL') is not None:
+            cell = self.parameterAsDouble(parameters, 'THINNING_CELL', context)
+            if cell > 0:
+                thinning = ThinningGrid(cell, self.parameterAsEnum(parameters, 'THINNING_MODE', context))
+
+        # incremental mode : the previous output is updated in place
+        previous_output = self.parameterAsVectorLayer(parameters, 'PREVIOUS_OUTPUT', context)
+        if previous_output is not None:
+            if projected_layer is None:
+                raise QgsProcessingException(self.tr('The incremental mode requires a projected layer'))
+            if sort_by_dist:
+                raise QgsProcessingException(self.tr('The incremental mode can not sort the output'))
+            if thinning is not None:
+                raise QgsProcessingException(self.tr('The incremental mode can not thin the points'))
+        projector.track = previous_output is not None or self.parameterAsBool(parameters, 'TRACK_FEATURES', context)
+
+        with ExitStack() as stack:
+            if projected_layer is not None:
+                # keep only fields in KEPT_FIELDS from PROJECTED_LAYER's attribute table
+                kept_fields = self.parameterAsFields(parameters, 'KEPT_FIELDS', context)
+                projector.kept_indexes = [index for index, field in enumerate(projected_layer.fields())
+                                          if field.name() in kept_fields]
+                for index in projector.kept_indexes:
+                    projector.fields.append(projected_layer.fields().at(index))
+                # only fetch the kept fields
+                request = QgsFeatureRequest().setSubsetOfAttributes(projector.kept_indexes)
+                projector.add_fields()
+
+                wkb_type = projected_layer.wkbType()
+                if dtm is not None:
+                    wkb_type = QgsWkbTypes.addZ(wkb_type)
+                crs = projected_layer.sourceCrs()
+                self.setTransforms(projector, crs, axis_layer, dtm, context, feedback)
+
+                if previous_output is not None:
+                    fids = self.updatePrevious(projector, projected_layer, previous_output, request, feedback)
+                    jobs = ((len(batch), projector.project_features, batch)
+                            for batch in self.fetchInOrder(projected_layer, request, fids, batch_size))
+                    total = len(fids)
+                elif sort_by_dist or thinning is not None:
+                    fids, x, y, z = self.readCoordinates(projected_layer, batch_size)
+                    if thinning is not None:
+                        kept = self.thin(thinning, projector, x, y, z, feedback)
+                        fids, x, y = fids[kept], x[kept], y[kept]
+                    order = np.arange(len(fids))
+                    if sort_by_dist:
+                        sorted_dist, sorted_reach, order = self.sortByDist(projector, x, y, batch_size, feedback)
+                    jobs = ((len(batch), partial(projector.project_features, rank=number * batch_size), batch)
+                            for number, batch in enumerate(self.fetchInOrder(projected_layer, request, fids[order],
+                                                                             batch_size)))
+                    total = len(order)
+                else:
+                    jobs = ((len(batch), projector.project_features, batch)
+                            for batch in batches(projected_layer.getFeatures(request), batch_size))
+                    total = projected_layer.featureCount()
+
+            elif xyz_file:
+                projector.add_fields()
+                projector.delimiter = self.parameterAsString(parameters, 'XYZ_DELIMITER', context) or None
+                wkb_type = QgsWkbTypes.PointZ
+                crs = self.parameterAsCrs(parameters, 'XYZ_CRS', context)
+                if not crs.isValid():
+                    crs = axis_layer.sourceCrs()
+                self.setTransforms(projector, crs, axis_layer, dtm, context, feedback)
+
+                # the lines of the file are read until the output is written
+                file = stack.enter_context(open(xyz_file, 'r'))
+                for _ in range(self.parameterAsInt(parameters, 'XYZ_HEADER_LINES', context)):
+                    file.readline()
+                if sort_by_dist or thinning is not None:
+                    # the sorted or thinned points are taken from memory, not from the file
+                    xyz = np.concatenate([projector.parse_lines(batch) for batch in batches(file, batch_size)]
+                                         or [np.empty((0, 3))])
+                    if thinning is not None:
+                        xyz = xyz[self.thin(thinning, projector, xyz[:, 0], xyz[:, 1], xyz[:, 2], feedback)]
+                    order = np.arange(len(xyz))
+                    if sort_by_dist:
+                        sorted_dist, sorted_reach, order = self.sortByDist(projector, xyz[:, 0], xyz[:, 1],
+                                                                           batch_size, feedback)
+                    jobs = ((len(batch), partial(projector.project_xyz, rank=number * batch_size), xyz[batch])
+                            for number, batch in enumerate(self.slices(order, batch_size)))
+                    total = len(order)
+                else:
+                    # progress is measured in characters read
+                    jobs = ((sum(len(line) for line in batch), projector.project_lines, batch)
+                            for batch in batches(file, batch_size))
+                    total = os.path.getsize(xyz_file)
+
+            else:
+                raise QgsProcessingException(self.tr('Either a projected layer or a XYZ file is required'))
+
+            if projector.output_m:
+                wkb_type = QgsWkbTypes.addM(wkb_type)
+            if previous_output is not None:
+                sink, dest_id = LayerSink(previous_output, projector.fields), previous_output.source()
+            else:
+                (sink, dest_id) = self.parameterAsSink(parameters, 'OUTPUT', context,
+                                                       projector.fields, wkb_type, crs)
+
+            snapped_sink, snapped_id = None, None
+            if projector.snapped:
+                snapped_wkb_type = QgsWkbTypes.PointM if projector.output_m else QgsWkbTypes.Point
+                (snapped_sink, snapped_id) = self.parameterAsSink(parameters, 'SNAPPED', context,
+                                                                  projector.fields, snapped_wkb_type,
+                                                                  axis_layer.sourceCrs())
+
+            try:
+                self.writeBatches(jobs, [sink, snapped_sink], total,
+                                  self.parameterAsInt(parameters, 'WORKERS', context), feedback)
+            finally:
+                if previous_output is not None:
+                    previous_output.updateExtents()
+
+        if chainage_index and not feedback.isCanceled():
+            self.writeChainageIndex(chainage_index, sorted_dist, sorted_reach,
+                                    projector.reach_ids if by_reach else None)
+
+        return dest_id, snapped_id, chainage_index
+
+    def updatePrevious(self, projector, projected_layer, previous_output, request, feedback):
+        """
+        Incremental mode : compares the features of the projected layer
+        with the ones recorded in the previous output, deletes the outputs
+        of the removed and modified features and returns the ids of the
+        features to be projected (the added and modified ones).
+        """
+        # the primary key fields (like the 'fid' of GeoPackages) are not output fields
+        provider = previous_output.dataProvider()
+        keys = provider.pkAttributeIndexes()
+        names = [field.name() for index, field in enumerate(provider.fields()) if index not in keys]
+        if names != projector.fields.names():
+            raise QgsProcessingException(self.tr('The previous output layer was not produced with the same options'))
+        capabilities = provider.capabilities()
+        if not (capabilities & QgsVectorDataProvider.AddFeatures and capabilities & QgsVectorDataProvider.DeleteFeatures):
+            raise QgsProcessingException(self.tr('The previous output layer can not be edited'))
+
+        # source feature id -> (output feature id, source hash)
+        fid_index = previous_output.fields().indexOf('src_fid')
+        hash_index = previous_output.fields().indexOf('src_hash')
+        previous_request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        previous_request.setSubsetOfAttributes([fid_index, hash_index])
+        records = {}
+        for feature in previous_output.getFeatures(previous_request):
+            attributes = feature.attributes()
+            records[attributes[fid_index]] = (feature.id(), attributes[hash_index])
+
+        projected, obsolete = [], []
+        for feature in projected_layer.getFeatures(request):
+            if feedback.isCanceled():
+                break
+            if not feature.hasGeometry():
+                continue
+            record = records.pop(feature.id(), None)
+            attributes = feature.attributes()
+            if record is not None and record[1] == feature_hash(feature, [attributes[index]
+                                                                          for index in projector.kept_indexes]):
+                continue
+            projected.append(feature.id())
+            if record is not None:
+                obsolete.append(record[0])
+        # the remaining records are the outputs of removed features
+        obsolete.extend(record[0] for record in records.values())
+
+        if feedback.isCanceled():
+            return np.empty(0, dtype=np.int64)
+        if obsolete and not provider.deleteFeatures(obsolete):
+            raise QgsProcessingException(self.tr('Unable to delete features from the previous output layer'))
+        feedback.pushInfo(self.tr('{} features to project, {} outputs deleted').format(len(projected), len(obsolete)))
+        return np.array(projected, dtype=np.int64)
+
+    def setTransforms(self, projector, crs, axis_layer, dtm, context, feedback):
+        """
+        Lets the projector transform the coordinates of the points, in
+        crs, to the CRS of the axis and of the DTM when they differ.
+        """
+        transform_context = context.transformContext()
+        projector.axis_transform = coordinate_transform(crs, axis_layer.sourceCrs(), transform_context)
+        if dtm is not None:
+            projector.dtm_transform = coordinate_transform(crs, dtm.crs(), transform_context)
+        if projector.axis_transform is not None or projector.dtm_transform is not None:
+            feedback.pushInfo(self.tr('The coordinates of the points are transformed on the fly'))
+
+    def slices(self, array, size):
+        """
+        Yields the consecutive slices of at most size items of array.
+        """
+        for start in range(0, len(array), size):
+            yield array[start:start + size]
+
+    def readCoordinates(self, layer, batch_size):
+        """
+        Returns the ids and the X, Y and Z coordinates of the features of a
+        point layer which have a geometry, without reading their attributes.
+        """
+        request = QgsFeatureRequest().setNoAttributes()
+        fids, x, y, z = [], [], [], []
+        for batch in batches(layer.getFeatures(request), batch_size):
+            vertices = [(feature.id(), feature.geometry().vertexAt(0)) for feature in batch if feature.hasGeometry()]
+            fids.append(np.array([fid for fid, _ in vertices], dtype=np.int64))
+            x.append(np.array([vertex.x() for _, vertex in vertices], dtype=float))
+            y.append(np.array([vertex.y() for _, vertex in vertices], dtype=float))
+            z.append(np.array([vertex.z() for _, vertex in vertices], dtype=float))
+        if not fids:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0)
+        return np.concatenate(fids), np.concatenate(x), np.concatenate(y), np.concatenate(z)
+
+    def thin(self, thinning, projector, x, y, z, feedback):
+        """
+        Returns the sorted indexes of the points (x, y, z) kept by the
+        thinning grid, which is laid in the CRS of the axis.
+        """
+        kept = thinning.select(*transform_coordinates(projector.axis_transform, x, y), z)
+        feedback.pushInfo(self.tr('{} points kept out of {} by the thinning').format(len(kept), len(x)))
+        return kept
+
+    def sortByDist(self, projector, x, y, batch_size, feedback):
+        """
+        First pass of a sorted projection : computes the curvilinear
+        distance and the reach of every point and returns the sorted
+        distances and reaches and the order of the points, sorted by reach
+        then by curvilinear distance. Points without distance come last,
+        unless they are dropped.
+        """
+        feedback.pushInfo(self.tr('Sorting the points by curvilinear distance...'))
+        results = [projector.chainage(x[batch], y[batch]) for batch in self.slices(np.arange(len(x)), batch_size)]
+        dist = np.concatenate([result[0] for result in results] or [np.empty(0)])
+        reach = np.concatenate([result[1] for result in results] or [np.empty(0, dtype=np.int64)])
+        # NaN values are sorted at the end of each reach and the points
+        # without reach after all the others, the stable sort keeps the
+        # input order of equal distances
+        order = np.lexsort((dist, np.where(reach < 0, np.iinfo(np.int64).max, reach)))
+        if projector.drop_out_of_range:
+            order = order[~np.isnan(dist[order])]
+        return dist[order], reach[order], order
+
+    def fetchInOrder(self, layer, request, fids, batch_size):
+        """
+        Yields batches of features of layer in the order of fids.
+        """
+        for batch in self.slices(fids, batch_size):
+            features = {feature.id(): feature
+                        for feature in layer.getFeatures(QgsFeatureRequest(request).setFilterFids(batch.tolist()))}
+            yield [features[fid] for fid in batch.tolist()]
+
+    def writeChainageIndex(self, path, sorted_dist, sorted_reach, reach_ids=None):
+        """
+        Writes the chainage range of each block of INDEX_BLOCK_SIZE
+        consecutive features of the sorted output to a CSV file, with the
+        'rank' of its first and last features, a block never spanning two
+        reaches. The points without curvilinear
+        distance are not indexed. If reach_ids is given, the reach ID of
+        each block is written in a first column.
+        """
+        count = int(np.count_nonzero(~np.isnan(sorted_dist)))
+        # starts of the runs of points on the same reach
+        starts = np.flatnonzero(np.diff(sorted_reach[:count], prepend=-2)).tolist() + [count]
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            header = ['dist_min', 'dist_max', 'first', 'last']
+            writer.writerow(header if reach_ids is None else ['reach'] + header)
+            for run_start, run_end in zip(starts[:-1], starts[1:]):
+                for first in range(run_start, run_end, self.INDEX_BLOCK_SIZE):
+                    last = min(first + self.INDEX_BLOCK_SIZE, run_end) - 1
+                    row = ['{:.3f}'.format(sorted_dist[first]), '{:.3f}'.format(sorted_dist[last]), first, last]
+                    if reach_ids is not None:
+                        row.insert(0, reach_ids.get(int(sorted_reach[first])))
+                    writer.writerow(row)
+
+    def writeBatches(self, jobs, sinks, total, workers, feedback):
+        """
+        Runs the (size, function, batch) jobs by a pool of workers, sharing
+        the (read only) projector, and writes their output features in
+        input order, each function returning one list of features per sink
+        (None sinks are skipped). The number of batches in memory is bounded, so that
+        memory use doesn't depend on the number of projected points.
+        """
+        written = 0
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for size, function, batch in jobs:
+                if feedback.isCanceled():
+                    break
+                pending.append((size, executor.submit(function, batch)))
+                if len(pending) <= 2 * workers:
+                    continue
+                size, future = pending.popleft()
+                self.addFeatures(sinks, future.result())
+                written += size
+                feedback.setProgress(int(100 * written / total) if total > 0 else 0)
+
+            while pending and not feedback.isCanceled():
+                size, future = pending.popleft()
+                self.addFeatures(sinks, future.result())
+                written += size
+                feedback.setProgress(int(100 * written / total) if total > 0 else 0)
+            for size, future in pending:
+                future.cancel()
+
+    def addFeatures(self, sinks, features):
+        for sink, sink_features in zip(sinks, features):
+            if sink is not None:
+                sink.addFeatures(sink_features, QgsFeatureSink.FastInsert)
+
+    def grassProjection(self, axis_layer, invert_axis, projected_layer, dtm, max_distance, parameters, context, feedback):
+        """
+        Computes the curvilinear distance of the projected layer features
+        with GRASS v.distance, after having prepared it with a chain of
+        child algorithms and in-memory copies of the layers.
+        """
         # keep only fields in KEPT_FIELDS from PROJECTED_LAYER's attribute table
-        fields = []
-        for field in projected_layer.fields():
-            fields.append(field.name())
-            
-        removed_fields = [field for field in fields if field not in parameters['KEPT_FIELDS']]
-        if len(removed_fields) > 0:
-            projected_layer = processing.run("qgis:deletecolumn",
-                                             {'INPUT':projected_layer,
-                                              'COLUMN':removed_fields,
-                                              'OUTPUT':'TEMPORARY_OUTPUT'},
-                                             is_child_algorithm=True,
-                                             context=context,
-                                             feedback=feedback)['OUTPUT']
-                                             
-        # add a new field "dist" to PROJECTED_LAYER's attribute table
-        projected_layer = processing.run("native:addfieldtoattributestable",
-                                         {'INPUT':projected_layer,
-                                          'FIELD_NAME':'dist',
-                                          'FIELD_TYPE':1,
-                                          'FIELD_LENGTH':10,
-                                          'FIELD_PRECISION':3,
-                                          'OUTPUT':'TEMPORARY_OUTPUT'},
-                                         is_child_algorithm=True,
-                                         context=context,
-                                         feedback=feedback)['OUTPUT']
+        # and add a new field "dist"
+        kept_fields = self.parameterAsFields(parameters, 'KEPT_FIELDS', context)
+        kept_indexes = [index for index, field in enumerate(projected_layer.fields())
+                        if field.name() in kept_fields]
+        projected_layer = subset_layer(projected_layer, kept_indexes,
+                                       [QgsField('dist', QVariant.Double, len=10, prec=3)])
                                          
         # if DTM has been set, set PROJECTED_LAYER's Z value from it
-        dtm = self.parameterAsRasterLayer(parameters, 'DTM', context)
-        
         if not parameters['DTM'] == None:
             projected_layer = processing.run("native:setzfromraster",
                                              {'INPUT':projected_layer,
@@ -237,12 +1716,25 @@ class PointProjection(QgsProcessingAlgorithm):
                                          context=context,
                                          feedback=feedback)['OUTPUT']
                                          
+        # delete all fields from AXIS_LAYER's attribute table
+        axis_layer = subset_layer(axis_layer, [])
+        
+        # if asked, invert the direction of the axis' line or polyline
+        if invert_axis:
+            axis_layer = processing.run("native:reverselinedirection",
+                                        {'INPUT':axis_layer,
+                                         'OUTPUT':'TEMPORARY_OUTPUT'},
+                                        is_child_algorithm=True,
+                                        context=context,
+                                        feedback=feedback)['OUTPUT']
+        
+        # execute v.distance algorithm
         projected_layer = processing.run("grass7:v.distance",
                                          {'from':projected_layer,
                                           'from_type':[0],
                                           'to':axis_layer,
                                           'to_type':[1],
-                                          'dmax':-1,
+                                          'dmax':-1 if max_distance is None else max_distance,
                                           'dmin':-1,
                                           'upload':[4],
                                           'column':['dist'],
@@ -259,6 +1751,5 @@ class PointProjection(QgsProcessingAlgorithm):
                                          is_child_algorithm=True,
                                          context=context,
                                          feedback=feedback)['from_output']
-                                         
-        # return the results of the algorithm
-        return {'OUTPUT':projected_layer}
+
+        return projected_layer
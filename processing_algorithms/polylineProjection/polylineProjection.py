@@ -10,19 +10,905 @@
 *                                                                         *
 ***************************************************************************
 
-- latest changes : 2022-02-02
+- latest changes : 2026-10-18
 - https://github.com/clementroussel/qgis/tree/main/scripts/polylineProjection
 """
 
-from qgis.PyQt.QtCore import QCoreApplication
-from qgis.core import (QgsProcessing,
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (Qgis,
+                       QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterVectorLayer,
                        QgsProcessingParameterBoolean,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterBand,
-                       QgsProcessingParameterFeatureSink)
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterDistance,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingException,
+                       QgsFeatureSink,
+                       QgsFeatureRequest,
+                       QgsFeature,
+                       QgsGeometry,
+                       QgsPoint,
+                       QgsFields,
+                       QgsField,
+                       QgsRectangle,
+                       QgsWkbTypes,
+                       QgsApplication,
+                       QgsMemoryProviderUtils,
+                       QgsCoordinateTransform,
+                       QgsCsException,
+                       QgsLineString)
 from qgis import processing
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+import hashlib
+import os
+import threading
+import numpy as np
+
+
+def batches(iterable, size):
+    """
+    Yields lists of at most size items of iterable.
+    """
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def subset_layer(layer, attributes, extra_fields=()):
+    """
+    Returns a memory layer with the features of layer restricted to the
+    attributes with the given indexes, followed by empty extra fields.
+    Only these attributes are fetched, which avoids the copies made by the
+    qgis:deletecolumn algorithm.
+    """
+    fields = QgsFields()
+    for index in attributes:
+        fields.append(layer.fields().at(index))
+    for field in extra_fields:
+        fields.append(field)
+
+    subset = QgsMemoryProviderUtils.createMemoryLayer(layer.name(), fields, layer.wkbType(), layer.sourceCrs())
+    request = QgsFeatureRequest().setSubsetOfAttributes(attributes)
+    for batch in batches(layer.getFeatures(request), 10000):
+        features = []
+        for feature in batch:
+            values = feature.attributes()
+            subset_feature = QgsFeature(fields)
+            subset_feature.setGeometry(feature.geometry())
+            subset_feature.setAttributes([values[index] for index in attributes] + [None] * len(extra_fields))
+            features.append(subset_feature)
+        subset.dataProvider().addFeatures(features)
+    return subset
+
+
+# coordinate transforms between pairs of CRS, reused by the next runs with the same transform context
+TRANSFORMS = {}
+
+
+def coordinate_transform(source, destination, transform_context):
+    """
+    Returns the transform from the source CRS to the destination CRS,
+    None if there is nothing to transform. Transforms are cached per pair
+    of CRS and per coordinate operations of the transform context, which
+    change with the datum transformations of the project.
+    """
+    if not source.isValid() or not destination.isValid() or source == destination:
+        return None
+    key = (source.toWkt(), destination.toWkt(), repr(sorted(transform_context.coordinateOperations().items())))
+    if key not in TRANSFORMS:
+        TRANSFORMS[key] = QgsCoordinateTransform(source, destination, transform_context)
+    return TRANSFORMS[key]
+
+
+def transform_coordinates(transform, x, y):
+    """
+    Transforms arrays of coordinates at once : they are stored as the
+    vertices of a line string, which is transformed in a single call.
+    """
+    if transform is None or len(x) == 0:
+        return x, y
+    line = QgsLineString(np.asarray(x, dtype=float).tolist(), np.asarray(y, dtype=float).tolist())
+    try:
+        line.transform(transform)
+    except QgsCsException as error:
+        raise QgsProcessingException('Unable to transform the coordinates : {}'.format(error))
+    return np.array(line.xVector(), dtype=float), np.array(line.yVector(), dtype=float)
+
+
+def wkb_header(data, offset):
+    """
+    Returns the byte order, the geometry type and the dimension (2 to 4
+    coordinates per vertex) of the WKB geometry starting at offset, and
+    the offset of its content.
+    """
+    order = '<' if data[offset] == 1 else '>'
+    wkb_type = int(np.frombuffer(data, order + 'u4', 1, offset + 1)[0])
+    # ISO types (1000 for Z, 2000 for M, 3000 for ZM) or 25D flag
+    flat_type = (wkb_type & 0x0fffffff) % 1000
+    has_z = bool(wkb_type & 0x80000000) or (wkb_type & 0x0fffffff) // 1000 in (1, 3)
+    has_m = bool(wkb_type & 0x40000000) or (wkb_type & 0x0fffffff) // 1000 in (2, 3)
+    return order, flat_type, has_z, has_m, offset + 5
+
+
+def wkb_parts(data):
+    """
+    Reads the vertices of a LineString or MultiLineString WKB buffer,
+    with or without Z and M values, as views on the buffer : no Python
+    object is created per vertex. Returns the X, Y, Z and M arrays of
+    each part, Z and M being NaN when missing.
+    """
+    order, flat_type, has_z, has_m, offset = wkb_header(data, 0)
+    if flat_type == 5:
+        count = int(np.frombuffer(data, order + 'u4', 1, offset)[0])
+        offset += 4
+    elif flat_type == 2:
+        count, offset = 1, 0
+    else:
+        raise ValueError('unsupported WKB geometry type {}'.format(flat_type))
+
+    parts = []
+    for _ in range(count):
+        order, flat_type, has_z, has_m, offset = wkb_header(data, offset)
+        dimension = 2 + has_z + has_m
+        size = int(np.frombuffer(data, order + 'u4', 1, offset)[0])
+        coordinates = np.frombuffer(data, order + 'f8', size * dimension, offset + 4).reshape(size, dimension)
+        offset += 4 + 8 * size * dimension
+        missing = np.full(size, np.nan)
+        parts.append((coordinates[:, 0], coordinates[:, 1],
+                      coordinates[:, 2] if has_z else missing,
+                      coordinates[:, dimension - 1] if has_m else missing))
+    return parts
+
+
+def grid_crossings(start, end, origin, size):
+    """
+    Finds where the segments from start to end (1D coordinates) cross the
+    lines origin + k * size of a grid. Returns the segment and the
+    position along it (from 0 to 1) of each crossing.
+    """
+    first = np.floor((start - origin) / size)
+    last = np.floor((end - origin) / size)
+    count = np.abs(last - first).astype(np.int64)
+    segment = np.repeat(np.arange(len(start)), count)
+    step = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    increasing = last[segment] > first[segment]
+    line = np.where(increasing, first[segment] + 1 + step, first[segment] - step)
+    t = (origin + line * size - start[segment]) / (end - start)[segment]
+    return segment, t
+
+
+def cell_runs(x, y, x_origin, y_origin, cell_x, cell_y):
+    """
+    Walks a line through the cells of a grid. Returns the curvilinear
+    abscissa of the vertices of the line and the one of the middle of
+    each run of the line within a cell, so that each crossed cell gives
+    a single sample.
+    """
+    length = np.hypot(np.diff(x), np.diff(y))
+    abscissa = np.concatenate(([0.], np.cumsum(length)))
+    crossings = [abscissa[:1], abscissa[-1:]]
+    for start, end, origin, size in ((x[:-1], x[1:], x_origin, cell_x), (y[:-1], y[1:], y_origin, cell_y)):
+        segment, t = grid_crossings(start, end, origin, size)
+        crossings.append(abscissa[segment] + t * length[segment])
+    bounds = np.unique(np.concatenate(crossings))
+    # a line through a corner of a cell crosses both grid lines at once
+    bounds = bounds[np.concatenate(([True], np.diff(bounds) > 1e-6 * min(cell_x, cell_y)))]
+    if len(bounds) == 1:
+        return abscissa, bounds
+    return abscissa, (bounds[:-1] + bounds[1:]) / 2
+
+
+def line_batches(features, size):
+    """
+    Yields lists of WKB buffers of the line features, each list holding
+    about size vertices. Curved geometries are segmentized first.
+    """
+    batch, vertices = [], 0
+    for feature in features:
+        if not feature.hasGeometry():
+            continue
+        geometry = feature.geometry()
+        if QgsWkbTypes.isCurvedType(geometry.wkbType()):
+            geometry = QgsGeometry(geometry.constGet().segmentize())
+        batch.append(bytes(geometry.asWkb()))
+        vertices += geometry.constGet().nCoordinates()
+        if vertices >= size:
+            yield batch
+            batch, vertices = [], 0
+    if batch:
+        yield batch
+
+
+class AxisModel:
+    """
+    In-memory model of the axis : its segments, the curvilinear distance
+    at the start of each of them and a packed R-tree over the segments.
+    The parts of a multiline axis are chained in the order in which they
+    are stored.
+    """
+
+    # number of children of each node of the R-tree
+    NODE_CAPACITY = 16
+
+    # number of points searched at once in the R-tree
+    CHUNK_SIZE = 4096
+
+    # for the vertices of lines, one vertex out of ANCHOR_STRIDE is located
+    # through the R-tree, the others first among the LOCAL_WINDOW segments
+    # on each side of the ones of their anchors
+    ANCHOR_STRIDE = 16
+    LOCAL_WINDOW = 4
+
+    def __init__(self, parts):
+        x0, y0, x1, y1 = [], [], [], []
+        for part in parts:
+            if len(part) < 2:
+                continue
+            x0.append(part[:-1, 0])
+            y0.append(part[:-1, 1])
+            x1.append(part[1:, 0])
+            y1.append(part[1:, 1])
+        if len(x0) == 0:
+            raise ValueError('the axis layer does not contain any line')
+        self.x0 = np.concatenate(x0)
+        self.y0 = np.concatenate(y0)
+        self.dx = np.concatenate(x1) - self.x0
+        self.dy = np.concatenate(y1) - self.y0
+        self.length = np.hypot(self.dx, self.dy)
+        self.start = np.concatenate(([0.], np.cumsum(self.length)[:-1]))
+        # avoid dividing by zero on duplicated vertices
+        self.length2 = np.where(self.length > 0, self.length ** 2, 1.)
+        self.build_index()
+
+    @classmethod
+    def from_layer(cls, layer, invert=False):
+        """
+        Builds the axis model from the features of a line layer.
+        """
+        parts = []
+        request = QgsFeatureRequest().setNoAttributes()
+        for feature in layer.getFeatures(request):
+            if not feature.hasGeometry():
+                continue
+            for part in feature.geometry().parts():
+                line = part.curveToLine()
+                parts.append(np.column_stack((line.xVector(), line.yVector())))
+        if invert:
+            parts = [part[::-1] for part in reversed(parts)]
+        return cls(parts)
+
+    def state(self):
+        """
+        Returns the arrays describing the model, R-tree included.
+        """
+        # the cache is shared with the point projection : a single reach
+        state = {'x0': self.x0, 'y0': self.y0, 'dx': self.dx, 'dy': self.dy,
+                 'length': self.length, 'start': self.start, 'reach': np.zeros(self.size, dtype=np.int64)}
+        for level, boxes in enumerate(self.levels):
+            state['level_{}'.format(level)] = np.vstack(boxes)
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuilds a model from the arrays returned by state().
+        """
+        model = cls.__new__(cls)
+        for name in ('x0', 'y0', 'dx', 'dy', 'length', 'start'):
+            setattr(model, name, state[name])
+        model.length2 = np.where(model.length > 0, model.length ** 2, 1.)
+        model.levels = []
+        while 'level_{}'.format(len(model.levels)) in state:
+            model.levels.append(tuple(state['level_{}'.format(len(model.levels))]))
+        return model
+
+    @property
+    def size(self):
+        return len(self.x0)
+
+    def build_index(self):
+        """
+        Builds the R-tree : consecutive segments of the axis are close to
+        each other, so the tree is packed by grouping NODE_CAPACITY
+        consecutive segments, then NODE_CAPACITY consecutive nodes, and so
+        on up to the root level.
+        """
+        x_min = np.minimum(self.x0, self.x0 + self.dx)
+        y_min = np.minimum(self.y0, self.y0 + self.dy)
+        x_max = np.maximum(self.x0, self.x0 + self.dx)
+        y_max = np.maximum(self.y0, self.y0 + self.dy)
+        self.levels = [(x_min, y_min, x_max, y_max)]
+        while len(self.levels[-1][0]) > self.NODE_CAPACITY:
+            starts = np.arange(0, len(self.levels[-1][0]), self.NODE_CAPACITY)
+            x_min, y_min, x_max, y_max = self.levels[-1]
+            self.levels.append((np.minimum.reduceat(x_min, starts),
+                                np.minimum.reduceat(y_min, starts),
+                                np.maximum.reduceat(x_max, starts),
+                                np.maximum.reduceat(y_max, starts)))
+
+    def locate(self, x, y, max_distance=None):
+        """
+        Finds the nearest segment of each point (x, y). Returns the index
+        of the segment (-1 if no segment lies within max_distance), the
+        position of the projected point on it (from 0 to 1) and the
+        distance from the point to the axis.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        segment = np.full(len(x), -1, dtype=np.int64)
+        t = np.full(len(x), np.nan)
+        gap = np.full(len(x), np.nan)
+        for i in range(0, len(x), self.CHUNK_SIZE):
+            chunk = slice(i, i + self.CHUNK_SIZE)
+            segment[chunk], t[chunk], gap[chunk] = self.search(x[chunk], y[chunk], max_distance)
+        return segment, t, gap
+
+    def locate_along(self, x, y, max_distance=None):
+        """
+        Same as locate for the consecutive vertices of lines, which
+        usually fall on the same or neighbouring segments of the axis :
+        anchor vertices are located through the R-tree, then the nearest
+        segment of the other vertices is looked for around the segment
+        interpolated between the ones of their anchors. The distance found
+        is a tight initial bound for the R-tree search which checks it, so
+        that it visits a few nodes only.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        count = len(x)
+        anchors = np.unique(np.append(np.arange(0, count, self.ANCHOR_STRIDE), count - 1)) if count else []
+        segment = np.full(count, -1, dtype=np.int64)
+        t = np.full(count, np.nan)
+        gap = np.full(count, np.nan)
+        segment[anchors], t[anchors], gap[anchors] = self.locate(x[anchors], y[anchors], max_distance)
+
+        found = anchors[segment[anchors] >= 0] if count else anchors
+        others = np.setdiff1d(np.arange(count), anchors)
+        if len(others) == 0:
+            return segment, t, gap
+        if len(found) == 0:
+            segment[others], t[others], gap[others] = self.locate(x[others], y[others], max_distance)
+            return segment, t, gap
+
+        # squared distance to the nearest segment of the local window
+        centre = np.rint(np.interp(others, found, segment[found])).astype(np.int64)
+        window = np.clip(centre[:, np.newaxis] + np.arange(-self.LOCAL_WINDOW, self.LOCAL_WINDOW + 1),
+                         0, self.size - 1)
+        px, py = x[others][:, np.newaxis], y[others][:, np.newaxis]
+        x0, y0, dx, dy = self.x0[window], self.y0[window], self.dx[window], self.dy[window]
+        position = np.clip(((px - x0) * dx + (py - y0) * dy) / self.length2[window], 0., 1.)
+        local = ((x0 + position * dx - px) ** 2 + (y0 + position * dy - py) ** 2).min(axis=1)
+        # leave some room for rounding errors
+        local = local * (1. + 1e-9) + 1e-12
+
+        for i in range(0, len(others), self.CHUNK_SIZE):
+            chunk = others[i:i + self.CHUNK_SIZE]
+            segment[chunk], t[chunk], gap[chunk] = self.search(x[chunk], y[chunk], max_distance,
+                                                               local[i:i + self.CHUNK_SIZE])
+        return segment, t, gap
+
+    def search(self, x, y, max_distance, bound=None):
+        """
+        Walks down the R-tree for a chunk of points. The pairs (point,
+        node) are pruned level by level with the smallest distance from the
+        point to the bounding box of the node, which can't exceed the
+        distance from the point to the first vertex of any other node, nor
+        the initial squared distance bound of the point if any.
+        """
+        count = len(x)
+        initial = bound
+        bound = np.full(count, np.inf if max_distance is None else max_distance ** 2, dtype=float)
+        if initial is not None:
+            bound = np.minimum(bound, initial)
+
+        roots = len(self.levels[-1][0])
+        pairs_point = np.repeat(np.arange(count), roots)
+        pairs_node = np.tile(np.arange(roots), count)
+
+        for level in range(len(self.levels) - 1, 0, -1):
+            x_min, y_min, x_max, y_max = (array[pairs_node] for array in self.levels[level])
+            px, py = x[pairs_point], y[pairs_point]
+            near_x = np.maximum(np.maximum(x_min - px, px - x_max), 0.)
+            near_y = np.maximum(np.maximum(y_min - py, py - y_max), 0.)
+
+            # pairs are sorted by point : update the bound point by point
+            first = pairs_node * self.NODE_CAPACITY ** level
+            vertex = (self.x0[first] - px) ** 2 + (self.y0[first] - py) ** 2
+            starts = np.flatnonzero(np.diff(pairs_point, prepend=-1))
+            points = pairs_point[starts]
+            bound[points] = np.minimum(bound[points], np.minimum.reduceat(vertex, starts))
+            kept = near_x ** 2 + near_y ** 2 <= bound[pairs_point]
+
+            # replace the kept nodes by their children
+            children = len(self.levels[level - 1][0])
+            pairs_point = np.repeat(pairs_point[kept], self.NODE_CAPACITY)
+            pairs_node = (self.NODE_CAPACITY * pairs_node[kept][:, np.newaxis]
+                          + np.arange(self.NODE_CAPACITY)).ravel()
+            valid = pairs_node < children
+            pairs_point, pairs_node = pairs_point[valid], pairs_node[valid]
+
+        # exact distance to the remaining segments
+        px, py = x[pairs_point], y[pairs_point]
+        x0, y0 = self.x0[pairs_node], self.y0[pairs_node]
+        dx, dy = self.dx[pairs_node], self.dy[pairs_node]
+        t = np.clip(((px - x0) * dx + (py - y0) * dy) / self.length2[pairs_node], 0., 1.)
+        d2 = (x0 + t * dx - px) ** 2 + (y0 + t * dy - py) ** 2
+
+        # keep the nearest segment of each point
+        starts = np.flatnonzero(np.diff(pairs_point, prepend=-1))
+        group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(d2))))
+        hits = np.flatnonzero(d2 == np.minimum.reduceat(d2, starts)[group])
+        nearest = hits[np.diff(group[hits], prepend=-1) != 0]
+        nearest = nearest[d2[nearest] <= bound[pairs_point[nearest]]]
+
+        segment = np.full(count, -1, dtype=np.int64)
+        position = np.full(count, np.nan)
+        gap = np.full(count, np.nan)
+        segment[pairs_point[nearest]] = pairs_node[nearest]
+        position[pairs_point[nearest]] = t[nearest]
+        gap[pairs_point[nearest]] = np.sqrt(d2[nearest])
+        return segment, position, gap
+
+    def snap(self, x, y, max_distance=None, along=False):
+        """
+        Orthogonal projection of the points (x, y) onto the axis. Returns
+        the curvilinear distance of the projected points, their coordinates
+        and the signed distance from the points to the axis (positive on
+        the left of the axis), all NaN for points farther than
+        max_distance. If along is True, the points are the consecutive
+        vertices of lines.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if along:
+            segment, t, gap = self.locate_along(x, y, max_distance)
+        else:
+            segment, t, gap = self.locate(x, y, max_distance)
+        found = segment >= 0
+        k = segment[found]
+        dist, snapped_x, snapped_y, offset = (np.full(len(segment), np.nan) for _ in range(4))
+        dist[found] = self.start[k] + t[found] * self.length[k]
+        snapped_x[found] = self.x0[k] + t[found] * self.dx[k]
+        snapped_y[found] = self.y0[k] + t[found] * self.dy[k]
+        side = self.dx[k] * (y[found] - snapped_y[found]) - self.dy[k] * (x[found] - snapped_x[found])
+        offset[found] = np.where(side < 0, -gap[found], gap[found])
+        return dist, snapped_x, snapped_y, offset
+
+    def position(self, dist):
+        """
+        Returns the coordinates of the points of the axis at the
+        curvilinear distances dist.
+        """
+        dist = np.asarray(dist, dtype=float)
+        segment = np.clip(np.searchsorted(self.start, dist, side='right') - 1, 0, self.size - 1)
+        t = np.clip((dist - self.start[segment]) / np.where(self.length[segment] > 0, self.length[segment], 1.), 0., 1.)
+        return self.x0[segment] + t * self.dx[segment], self.y0[segment] + t * self.dy[segment]
+
+
+class AxisCache:
+    """
+    On-disk cache of the axis models, so that the axis is prepared only
+    once when it is used for many projected layers. A model is identified
+    by the source of the axis layer, the modification time of its file and
+    the options used to build it. The least recently used models are
+    evicted when the cache exceeds MAX_SIZE bytes.
+    """
+
+    MAX_SIZE = 512 * 1024 ** 2
+
+    # to be increased whenever the AxisModel attributes change
+    VERSION = 2
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(QgsApplication.qgisSettingsDirPath(), 'cache', 'onf-rtm-tools', 'axis')
+        self.directory = directory
+
+    def key(self, layer, *options):
+        """
+        Returns the cache key of a layer, None if it can't be cached (no
+        file behind it or unsaved changes).
+        """
+        path = layer.source().split('|')[0]
+        if not os.path.isfile(path) or layer.isModified():
+            return None
+        items = (self.VERSION, layer.source(), os.path.getmtime(path))
+        # the edits of a GeoPackage in WAL mode stay in its sidecar file until a checkpoint
+        wal = path + '-wal'
+        if os.path.isfile(wal):
+            items += (os.path.getmtime(wal), os.path.getsize(wal))
+        identity = '|'.join(str(item) for item in items + options)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def load(self, key):
+        path = os.path.join(self.directory, key + '.npz')
+        try:
+            with np.load(path) as arrays:
+                model = AxisModel.from_state(arrays)
+        except (OSError, ValueError, KeyError):
+            return None
+        # mark the model as recently used
+        os.utime(path)
+        return model
+
+    def save(self, key, model):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key + '.npz')
+        with open(path + '.tmp', 'wb') as file:
+            np.savez(file, **model.state())
+        os.replace(path + '.tmp', path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                status = os.stat(os.path.join(self.directory, name))
+                entries.append((status.st_mtime, status.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.MAX_SIZE:
+                break
+            os.remove(os.path.join(self.directory, name))
+            size -= entry_size
+
+    def get(self, layer, invert, feedback=None):
+        """
+        Returns the axis model of a layer, from the cache if possible.
+        """
+        # same key as the single axis models of the point projection
+        key = self.key(layer, invert, None)
+        if key is not None:
+            model = self.load(key)
+            if model is not None:
+                if feedback is not None:
+                    feedback.pushInfo('Axis model read from the cache')
+                return model
+        model = AxisModel.from_layer(layer, invert)
+        if key is not None:
+            try:
+                self.save(key, model)
+            except OSError:
+                if feedback is not None:
+                    feedback.reportError('Unable to write the axis model in the cache')
+        return model
+
+
+class RasterSampler:
+    """
+    Vectorized sampling of a raster band : the points are grouped by
+    tiles of the raster, each tile being read once as a NumPy array. The
+    value of the cell containing each point is returned, NaN where the
+    point is outside the raster or on a no data cell. Data providers are
+    not thread safe, so each thread reads the raster through its own
+    clone of the provider.
+    """
+
+    DATA_TYPES = {Qgis.Byte: np.uint8,
+                  Qgis.UInt16: np.uint16,
+                  Qgis.Int16: np.int16,
+                  Qgis.UInt32: np.uint32,
+                  Qgis.Int32: np.int32,
+                  Qgis.Float32: np.float32,
+                  Qgis.Float64: np.float64}
+
+    TILE_SIZE = 1024
+
+    def __init__(self, raster_layer, band):
+        self.source_provider = raster_layer.dataProvider()
+        self.local = threading.local()
+        self.band = band
+        self.extent = raster_layer.extent()
+        self.width = raster_layer.width()
+        self.height = raster_layer.height()
+        self.cell_x = self.extent.width() / self.width
+        self.cell_y = self.extent.height() / self.height
+        self.dtype = self.DATA_TYPES.get(self.source_provider.dataType(band), np.float64)
+        self.nodata = None
+        if self.source_provider.sourceHasNoDataValue(band) and self.source_provider.useSourceNoDataValue(band):
+            self.nodata = self.source_provider.sourceNoDataValue(band)
+
+    @property
+    def provider(self):
+        if threading.current_thread() is threading.main_thread():
+            return self.source_provider
+        if not hasattr(self.local, 'provider'):
+            self.local.provider = self.source_provider.clone()
+        return self.local.provider
+
+    def sample(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        values = np.full(len(x), np.nan)
+
+        col = np.floor((x - self.extent.xMinimum()) / self.cell_x).astype(np.int64)
+        row = np.floor((self.extent.yMaximum() - y) / self.cell_y).astype(np.int64)
+        inside = (col >= 0) & (col < self.width) & (row >= 0) & (row < self.height)
+
+        # group the points by tile
+        indexes = np.flatnonzero(inside)
+        tiles = (row[indexes] // self.TILE_SIZE) * (self.width // self.TILE_SIZE + 1) \
+            + col[indexes] // self.TILE_SIZE
+        order = np.argsort(tiles, kind='stable')
+        indexes, tiles = indexes[order], tiles[order]
+        bounds = np.flatnonzero(np.diff(tiles)) + 1
+
+        for selection in np.split(indexes, bounds):
+            if len(selection) == 0:
+                continue
+            col_min, col_max = col[selection].min(), col[selection].max()
+            row_min, row_max = row[selection].min(), row[selection].max()
+            block = self.read(col_min, row_min, col_max - col_min + 1, row_max - row_min + 1)
+            values[selection] = block[row[selection] - row_min, col[selection] - col_min]
+
+        return values
+
+    def read(self, col, row, cols, rows):
+        """
+        Reads a window of the raster band as a NumPy array.
+        """
+        x_min = self.extent.xMinimum() + col * self.cell_x
+        y_max = self.extent.yMaximum() - row * self.cell_y
+        extent = QgsRectangle(x_min, y_max - rows * self.cell_y, x_min + cols * self.cell_x, y_max)
+        block = self.provider.block(self.band, extent, int(cols), int(rows))
+        data = np.frombuffer(bytes(block.data()), dtype=self.dtype).reshape(int(rows), int(cols))
+        data = data.astype(float)
+        if self.nodata is not None:
+            data[data == self.nodata] = np.nan
+        return data
+
+
+class Deduplicator:
+    """
+    Removes the duplicated points : their coordinates are rounded to the
+    tolerance and compared as rows of bytes, so that no temporary layer is
+    needed. The keys of the points already written are kept in a hash set,
+    so that duplicates are also found across batches. A zero tolerance
+    compares the exact coordinates.
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.seen = set()
+
+    def keys(self, *coordinates):
+        """
+        Returns one key per point : its rounded coordinates, as bytes.
+        Missing values (NaN) are equal to each other.
+        """
+        columns = []
+        for values in coordinates:
+            values = np.asarray(values, dtype=float)
+            column = np.full(len(values), np.iinfo(np.int64).min)
+            known = ~np.isnan(values)
+            if self.tolerance > 0:
+                column[known] = np.round(values[known] / self.tolerance).astype(np.int64)
+            else:
+                column[known] = values[known].view(np.int64)
+            columns.append(column)
+        rows = np.ascontiguousarray(np.column_stack(columns))
+        return rows.view(np.dtype((np.void, 8 * len(columns)))).ravel()
+
+    def first(self, keys):
+        """
+        Returns the mask of the first occurrence of each key.
+        """
+        _, indexes = np.unique(keys, return_index=True)
+        mask = np.zeros(len(keys), dtype=bool)
+        mask[indexes] = True
+        return mask
+
+    def merge(self, result):
+        """
+        Removes from the features of a batch the points already written by
+        the previous batches. Batches must be merged in input order.
+        """
+        output_features, snapped_features, (output_keys, snapped_keys) = result
+        # the keys of a batch are unique (see first)
+        new_keys = set(output_keys.tolist()) - self.seen
+        self.seen |= new_keys
+        return ([feature for feature, key in zip(output_features, output_keys.tolist()) if key in new_keys],
+                [feature for feature, key in zip(snapped_features, snapped_keys.tolist()) if key in new_keys])
+
+
+class ProfileResampler:
+    """
+    Resamples the longitudinal profile made of the projected points : the
+    curvilinear distances and Z values of all the batches are gathered,
+    sorted by distance, and Z is interpolated at a fixed chainage step or
+    at a number of evenly spaced stations.
+    """
+
+    def __init__(self, step=None, count=None):
+        self.step = step
+        self.count = count
+        self.dist = []
+        self.z = []
+
+    def collect(self, result):
+        """
+        Keeps the curvilinear distances and the Z values of a batch. Used
+        as the merge function of writeBatches, nothing is written.
+        """
+        dist, z = result
+        self.dist.append(dist)
+        self.z.append(z)
+        return []
+
+    def stations(self, dist_min, dist_max):
+        """
+        Returns the curvilinear distances of the resampled points.
+        """
+        if self.step is not None:
+            return np.arange(np.ceil(dist_min / self.step), np.floor(dist_max / self.step) + 1) * self.step
+        return np.linspace(dist_min, dist_max, self.count)
+
+    def resample(self):
+        """
+        Returns the curvilinear distances and the interpolated Z values of
+        the resampled profile.
+        """
+        dist = np.concatenate(self.dist or [np.empty(0)])
+        z = np.concatenate(self.z or [np.empty(0)])
+        if len(dist) == 0:
+            return dist, z
+        order = np.argsort(dist, kind='stable')
+        dist, z = dist[order], z[order]
+        stations = self.stations(dist[0], dist[-1])
+        return stations, np.interp(stations, dist, z)
+
+
+class PointProjector:
+    """
+    Projection of batches of vertices onto the axis. Builds the output
+    features : 'dist', 'Z' and, if asked, 'offset'. The curvilinear
+    distance can also be stored as the M value of the geometries, and the
+    projected points on the axis can be returned as a second set of
+    features.
+    """
+
+    def __init__(self, axis, sampler=None):
+        self.axis = axis
+        self.sampler = sampler
+        self.fields = QgsFields()
+        self.output_m = False
+        self.add_offset = False
+        self.snapped = False
+        # transforms from the CRS of the vertices to the ones of the axis and of the DTM
+        self.axis_transform = None
+        self.dtm_transform = None
+        # replace the vertices by one sample per DTM cell
+        self.interpolate = False
+        self.deduplicator = None
+
+    def add_fields(self):
+        """
+        Appends the fields computed by the projection.
+        """
+        self.fields.append(QgsField('dist', QVariant.Double, len=10, prec=3))
+        self.fields.append(QgsField('Z', QVariant.Double, len=10, prec=3))
+        if self.add_offset:
+            self.fields.append(QgsField('offset', QVariant.Double, len=10, prec=3))
+
+    def project_coordinates(self, x, y, z):
+        """
+        Returns the curvilinear distance, the Z value, the coordinates of
+        the projected points and the signed offset of the points (x, y, z),
+        Z being sampled from the DTM if any. The projected points are in
+        the CRS of the axis.
+        """
+        if self.sampler is not None:
+            # like native:setzfromraster, no data cells give a zero Z value
+            z = self.sampler.sample(*transform_coordinates(self.dtm_transform, x, y))
+            z[np.isnan(z)] = 0.
+        # consecutive vertices of the lines fall on neighbouring segments
+        dist, snapped_x, snapped_y, offset = self.axis.snap(*transform_coordinates(self.axis_transform, x, y),
+                                                            along=True)
+        return dist, z, snapped_x, snapped_y, offset
+
+    def output(self, geometry, current, dist, z, snapped_x, snapped_y, offset):
+        """
+        Returns the output feature of a projected point and, if asked, the
+        corresponding point on the axis.
+        """
+        if self.output_m:
+            geometry.get().dropMValue()
+            geometry.get().addMValue(float(dist[current]))
+
+        attributes = [None if np.isnan(dist[current]) else float(dist[current]),
+                      None if np.isnan(z[current]) else float(z[current])]
+        if self.add_offset:
+            attributes.append(None if np.isnan(offset[current]) else float(offset[current]))
+
+        output_feature = QgsFeature(self.fields)
+        output_feature.setGeometry(geometry)
+        output_feature.setAttributes(attributes)
+
+        snapped_feature = None
+        if self.snapped and not np.isnan(dist[current]):
+            snapped_point = QgsPoint(snapped_x[current], snapped_y[current])
+            if self.output_m:
+                snapped_point.addMValue(float(dist[current]))
+            snapped_feature = QgsFeature(self.fields)
+            snapped_feature.setGeometry(QgsGeometry(snapped_point))
+            snapped_feature.setAttributes(attributes)
+
+        return output_feature, snapped_feature
+
+    def project_lines(self, lines):
+        """
+        Projects the vertices of a batch of lines given as WKB buffers, in
+        bulk. Returns the output features and the projected points on the
+        axis and, when removing duplicates, the keys of both to be merged
+        by the deduplicator.
+        """
+        x, y, z, m = self.line_vertices(lines)
+
+        if self.deduplicator is not None:
+            # Z sampled from the DTM only depends on X and Y
+            keys = self.deduplicator.keys(x, y)
+            first = self.deduplicator.first(keys)
+            x, y, z, m, keys = x[first], y[first], z[first], m[first], keys[first]
+
+        results = self.project_coordinates(x, y, z)
+        z = results[1]
+
+        output_features, snapped_features = [], []
+        snapped_indexes = []
+        for current in range(len(x)):
+            # missing Z and M values (NaN) give a point without them
+            geometry = QgsGeometry(QgsPoint(x[current], y[current], z[current], m[current]))
+            output_feature, snapped_feature = self.output(geometry, current, *results)
+            output_features.append(output_feature)
+            if snapped_feature is not None:
+                snapped_features.append(snapped_feature)
+                snapped_indexes.append(current)
+
+        if self.deduplicator is not None:
+            return output_features, snapped_features, (keys, keys[snapped_indexes])
+        return output_features, snapped_features
+
+    def profile_lines(self, lines):
+        """
+        Returns the curvilinear distance and the Z value of the projected
+        vertices of a batch of lines, without building any feature, to be
+        resampled.
+        """
+        x, y, z, _ = self.line_vertices(lines)
+        dist, z = self.project_coordinates(x, y, z)[:2]
+        projected = ~np.isnan(dist)
+        return dist[projected], np.asarray(z, dtype=float)[projected]
+
+    def line_vertices(self, lines):
+        """
+        Returns the X, Y, Z and M arrays of the vertices of a batch of lines
+        given as WKB buffers, interpolated on the DTM cells if asked.
+        """
+        parts = [part for line in lines for part in wkb_parts(line)]
+        if self.interpolate and self.sampler is not None:
+            parts = [self.cell_samples(*part) for part in parts]
+        return tuple(np.concatenate([part[index] for part in parts] or [np.empty(0)]) for index in range(4))
+
+    def cell_samples(self, x, y, z, m):
+        """
+        Replaces the vertices of a line part by one sample per DTM cell
+        crossed by the line, at the middle of the line within the cell.
+        The line is walked through the cells in the CRS of the DTM.
+        """
+        if len(x) == 0:
+            return x, y, z, m
+        dtm_x, dtm_y = transform_coordinates(self.dtm_transform, x, y)
+        abscissa, samples = cell_runs(dtm_x, dtm_y, self.sampler.extent.xMinimum(), self.sampler.extent.yMaximum(),
+                                      self.sampler.cell_x, self.sampler.cell_y)
+        return tuple(np.interp(samples, abscissa, values) for values in (x, y, z, m))
 
 
 class PolylineProjection(QgsProcessingAlgorithm):
@@ -30,6 +916,9 @@ class PolylineProjection(QgsProcessingAlgorithm):
     Here is the class documentation.
     """
 
+    # number of vertices projected at once by the native engine
+    BATCH_SIZE = 100000
+
     def tr(self, string):
         """
         Returns a translatable string with the self.tr() function.
@@ -73,11 +962,20 @@ class PolylineProjection(QgsProcessingAlgorithm):
         <p>Orthogonal projection of a line or multiline layer onto another line or multiline vector layer.<\p>
         <h2>Inputs<\h2>
         <p>Axis layer : Should contain a single line or multiline feature onto which points will be projected.<\p>
-        <p>Projected layer : Should contain a single line or multiline layer to be projected.<\p>
+        <p>Projected layer : Should contain a single line or multiline layer to be projected. If its CRS differs from the one of the axis layer or of the DTM, its vertices are transformed on the fly (native engine only). The native engine reads the vertices straight from the lines, without any intermediate layer.<\p>
         <p>Digital Terrain Model (DTM) : If provided, projected layer vertices' Z value will be extracted from it. Else, the algorithm will try to extract the Z value of the projected layer vertices' geometry.<\p>
-        <p>Interpolate : If checked, the projected layer will be interpolated on the DTM and, consequently, new vertices will be created. Warning : doesn't work with SAGA 2.3.2 but works with SAGA 7.8.2<\p>
+        <p>Interpolate : If checked, the projected layer will be interpolated on the DTM and, consequently, new vertices will be created. The native engine walks the lines through the DTM cells and replaces their vertices by one point per cell crossed, at the middle of the line within the cell. The GRASS engine uses SAGA 'Profiles from lines'. Warning : the GRASS engine doesn't work with SAGA 2.3.2 but works with SAGA 7.8.2<\p>
+        <p>Duplicate points tolerance : If provided and the lines are interpolated on the DTM, output points whose coordinates (X and Y, Z being sampled from the DTM) are equal once rounded to this tolerance are written once, in memory and during the projection. A zero tolerance, the default, removes the exact duplicates only (native engine only).<\p>
+        <p>Resampling step : If provided, the output is the resampled longitudinal profile instead of the projected vertices : one point every step of curvilinear distance, on the axis, whose Z value is interpolated between the projected vertices sorted by 'dist'. The duplicate points tolerance doesn't apply and no projected vertices on the axis are written (native engine only).<\p>
+        <p>Number of resampled points : If greater than 1 and without resampling step, the profile is resampled at this number of points evenly spaced between the smallest and the largest 'dist' (native engine only).<\p>
+        <p>Store the curvilinear distance as M value : If checked, output geometries get a M value equal to 'dist' (native engine only).<\p>
+        <p>Add the signed offset from the axis : If checked, a field 'offset' gives the distance from the vertex to the axis, positive on the left of the axis and negative on its right (native engine only).<\p>
+        <p>Projection engine : 'Native' computes the projection in QGIS itself (the parts of a multiline axis are chained in their storage order). 'GRASS v.distance' is the former behaviour and requires GRASS.<\p>
+        <p>Use the axis cache : If checked, the prepared axis is stored on disk and reused by the next runs on the same axis layer, as long as its file is not modified (native engine only).<\p>
+        <p>Number of parallel workers : Number of batches of lines whose vertices are read, sampled and projected at the same time by the native engine. Up to the number of cores of the computer. The output is written in the order of the lines whatever the number of workers.<\p>
         <h2>Output<\h2>
         <p>The output layer is a point layer whose attribute table contains a field 'dist' which corresponds to the curvilinear distance of the projected vertices onto the axis.<\p>
+        <p>Projected vertices on the axis : If set, the feet of the perpendiculars from the vertices to the axis, with the same attributes as the output layer (native engine only).<\p>
         <\body><\html>
         """
         return self.tr(help)
@@ -136,6 +1034,81 @@ class PolylineProjection(QgsProcessingAlgorithm):
                 False
             )
         )
+        
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'DUPLICATE_TOLERANCE',
+                self.tr('Duplicate points tolerance'),
+                defaultValue=0,
+                parentParameterName='PROJECTED_LAYER',
+                minValue=0,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'RESAMPLING_STEP',
+                self.tr('Resampling step'),
+                defaultValue=None,
+                parentParameterName='AXIS_LAYER',
+                minValue=0,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'RESAMPLING_COUNT',
+                self.tr('Number of resampled points'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'OUTPUT_M',
+                self.tr('Store the curvilinear distance as M value'),
+                False
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'ADD_OFFSET',
+                self.tr('Add the signed offset from the axis'),
+                False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                'ENGINE',
+                self.tr('Projection engine'),
+                options=[self.tr('Native'), self.tr('GRASS v.distance')],
+                defaultValue=0
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                'USE_CACHE',
+                self.tr('Use the axis cache'),
+                True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'WORKERS',
+                self.tr('Number of parallel workers'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=1
+            )
+        )
 
         self.addParameter(
             QgsProcessingParameterFeatureSink(
@@ -144,57 +1117,41 @@ class PolylineProjection(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                'SNAPPED',
+                self.tr('Projected vertices on the axis'),
+                QgsProcessing.TypeVectorPoint,
+                optional=True,
+                createByDefault=False
+            )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """        
         axis_layer = self.parameterAsVectorLayer(parameters, 'AXIS_LAYER', context)
-        
-        # delete all fields from AXIS_LAYER's attribute table
-        fields = []
-        for field in axis_layer.fields():
-            fields.append(field.name())
-            
-        axis_layer = processing.run("qgis:deletecolumn",
-                                    {'INPUT':axis_layer,
-                                     'COLUMN':fields,
-                                     'OUTPUT':'TEMPORARY_OUTPUT'},
-                                    is_child_algorithm=True,
-                                    context=context,
-                                    feedback=feedback)['OUTPUT']
-                                     
-        
         invert_axis = self.parameterAsBool(parameters, 'INVERT_AXIS', context)
-        
-        # if asked, invert the direction of the axis' line or polyline
-        if invert_axis:
-            axis_layer = processing.run("native:reverselinedirection",
-                                        {'INPUT':axis_layer,
-                                         'OUTPUT':'TEMPORARY_OUTPUT'},
-                                        is_child_algorithm=True,
-                                        context=context,
-                                        feedback=feedback)['OUTPUT']
+        engine = self.parameterAsEnum(parameters, 'ENGINE', context)
         
         projected_line_layer = self.parameterAsVectorLayer(parameters, 'PROJECTED_LAYER', context)        
-        
-        # remove all fields from PROJECTED_LAYER's attribute table
-        fields = []
-        for field in projected_line_layer.fields():
-            fields.append(field.name())
-            
-        if len(fields) > 0:
-            projected_line_layer = processing.run("qgis:deletecolumn",
-                                                  {'INPUT':projected_line_layer,
-                                                   'COLUMN':fields,
-                                                   'OUTPUT':'TEMPORARY_OUTPUT'},
-                                                  is_child_algorithm=True,
-                                                  context=context,
-                                                  feedback=feedback)['OUTPUT']
                                                   
         dtm = self.parameterAsRasterLayer(parameters, 'DTM', context)
+        interpolate = self.parameterAsBool(parameters, 'INTERPOLATE', context)
+
+        # the native engine reads the vertices straight from the lines
+        if engine == 0:
+            projected_layer, snapped_layer = self.nativeProjection(axis_layer, invert_axis, projected_line_layer, dtm,
+                                                                   parameters, context, feedback)
+            return self.results(projected_layer, snapped_layer)
+        
+        # remove all fields from PROJECTED_LAYER's attribute table
+        projected_line_layer = subset_layer(projected_line_layer, [])
         
-        # if no DTM
-        if parameters['DTM'] == None:
+        # if no DTM or no interpolation
+        if parameters['DTM'] == None or not interpolate:
+            feedback.pushInfo("No interpolation")
             # extract the vertices
             projected_layer = processing.run("native:extractvertices",
                                              {'INPUT':projected_line_layer,
@@ -202,153 +1159,233 @@ class PolylineProjection(QgsProcessingAlgorithm):
                                              is_child_algorithm=True,
                                              context=context,
                                              feedback=feedback)['OUTPUT']
-                                     
-            # convert the result (which is a str id) as a vector layer
-            projected_layer = context.takeResultLayer(projected_layer)
-                                         
-            # remove all fields created by the previous algorithm
-            fields = []
-            for field in projected_layer.fields():
-                fields.append(field.name())
-            
-            if len(fields) > 0:
-                projected_layer = processing.run("qgis:deletecolumn",
-                                                 {'INPUT':projected_layer,
-                                                  'COLUMN':fields,
-                                                  'OUTPUT':'TEMPORARY_OUTPUT'},
-                                                 is_child_algorithm=True,
-                                                 context=context,
-                                                 feedback=feedback)['OUTPUT']
                                              
-            # add a new field "dist" to PROJECTED_LAYER's attribute table
-            projected_layer = processing.run("native:addfieldtoattributestable",
-                                             {'INPUT':projected_layer,
-                                              'FIELD_NAME':'dist',
-                                              'FIELD_TYPE':1,
-                                              'FIELD_LENGTH':10,
-                                              'FIELD_PRECISION':3,
+        else:
+            # add an id field
+            projected_layer = processing.run("native:addautoincrementalfield",
+                                             {'INPUT':projected_line_layer,
+                                              'FIELD_NAME':'ID',
+                                              'START':0,
+                                              'GROUP_FIELDS':[],
+                                              'SORT_EXPRESSION':'',
+                                              'SORT_ASCENDING':True,
+                                              'SORT_NULLS_FIRST':False,
                                               'OUTPUT':'TEMPORARY_OUTPUT'},
                                              is_child_algorithm=True,
                                              context=context,
                                              feedback=feedback)['OUTPUT']
-                                                  
-            # add a new field "Z" to PROJECTED_LAYER's attribute table
-            projected_layer = processing.run("native:fieldcalculator",
-                                         {'INPUT':projected_layer,
-                                          'FIELD_NAME':'Z',
-                                          'FIELD_TYPE':0,
-                                          'FIELD_LENGTH':10,
-                                          'FIELD_PRECISION':3,
-                                          'FORMULA':'z($geometry)',
-                                          'OUTPUT':'TEMPORARY_OUTPUT'},
-                                         is_child_algorithm=True,
-                                         context=context,
-                                         feedback=feedback)['OUTPUT']
-                                    
-            # execute v.distance algorithm
-            projected_layer = processing.run("grass7:v.distance",
-                                             {'from':projected_layer,
-                                              'from_type':[0],
-                                              'to':axis_layer,
-                                              'to_type':[1],
-                                              'dmax':-1,
-                                              'dmin':-1,
-                                              'upload':[4],
-                                              'column':['dist'],
-                                              'to_column':'',
-                                              'from_output':parameters['OUTPUT'],
-                                              'output':'TEMPORARY_OUTPUT',
-                                              'GRASS_REGION_PARAMETER':None,
-                                              'GRASS_SNAP_TOLERANCE_PARAMETER':-1,
-                                              'GRASS_MIN_AREA_PARAMETER':0.0001,
-                                              'GRASS_OUTPUT_TYPE_PARAMETER':1,
-                                              'GRASS_VECTOR_DSCO':'',
-                                              'GRASS_VECTOR_LCO':'',
-                                              'GRASS_VECTOR_EXPORT_NOCAT':False},
+
+            # execute "Profiles from Lines" algorithm
+            projected_layer = processing.run("saga:profilesfromlines",
+                                             {'DEM':parameters['DTM'],
+                                              'VALUES':None,
+                                              'LINES':projected_layer,
+                                              'NAME':'ID',
+                                              'PROFILE':'TEMPORARY_OUTPUT',
+                                              'PROFILES':'TEMPORARY_OUTPUT',
+                                              'SPLIT':False},
                                              is_child_algorithm=True,
                                              context=context,
-                                             feedback=feedback)['from_output']
-                                                  
-        else:
-            interpolate = self.parameterAsBool(parameters, 'INTERPOLATE', context)
+                                             feedback=feedback)['PROFILE']
+               
+            # delete duplicates by attribute
+            projected_layer = processing.run("native:removeduplicatesbyattribute", 
+                                             {'INPUT':projected_layer,
+                                              'FIELDS':['X','Y','Z'],
+                                              'OUTPUT':'TEMPORARY_OUTPUT'},
+                                             is_child_algorithm=True,
+                                             context=context,
+                                             feedback=feedback)['OUTPUT']
             
-            if not interpolate:
-                feedback.pushInfo("No interpolation")
-                # extract the vertices
-                projected_layer = processing.run("native:extractvertices",
-                                                 {'INPUT':projected_line_layer,
-                                                  'OUTPUT':'TEMPORARY_OUTPUT'},
-                                                 is_child_algorithm=True,
-                                                 context=context,
-                                                 feedback=feedback)['OUTPUT']
-                                                 
-            else:
-                # add an id field
-                projected_layer = processing.run("native:addautoincrementalfield",
-                                                 {'INPUT':projected_line_layer,
-                                                  'FIELD_NAME':'ID',
-                                                  'START':0,
-                                                  'GROUP_FIELDS':[],
-                                                  'SORT_EXPRESSION':'',
-                                                  'SORT_ASCENDING':True,
-                                                  'SORT_NULLS_FIRST':False,
-                                                  'OUTPUT':'TEMPORARY_OUTPUT'},
-                                                 is_child_algorithm=True,
-                                                 context=context,
-                                                 feedback=feedback)['OUTPUT']
-
-                # execute "Profiles from Lines" algorithm
-                projected_layer = processing.run("saga:profilesfromlines",
-                                                 {'DEM':parameters['DTM'],
-                                                  'VALUES':None,
-                                                  'LINES':projected_layer,
-                                                  'NAME':'ID',
-                                                  'PROFILE':'TEMPORARY_OUTPUT',
-                                                  'PROFILES':'TEMPORARY_OUTPUT',
-                                                  'SPLIT':False},
-                                                 is_child_algorithm=True,
-                                                 context=context,
-                                                 feedback=feedback)['PROFILE']
-                   
-                # delete duplicates by attribute
-                projected_layer = processing.run("native:removeduplicatesbyattribute", 
-                                                 {'INPUT':projected_layer,
-                                                  'FIELDS':['X','Y','Z'],
-                                                  'OUTPUT':'TEMPORARY_OUTPUT'},
-                                                 is_child_algorithm=True,
-                                                 context=context,
-                                                 feedback=feedback)['OUTPUT']
-                
-            # convert the result (which is a str id) as a vector layer
-            projected_layer = context.takeResultLayer(projected_layer)
-                                         
-            # remove all fields created by the previous algorithm
-            fields = []
-            for field in projected_layer.fields():
-                fields.append(field.name())
-                
-            if len(fields) > 0:
-                projected_layer = processing.run("qgis:deletecolumn",
-                                                 {'INPUT':projected_layer,
-                                                  'COLUMN':fields,
-                                                  'OUTPUT':'TEMPORARY_OUTPUT'},
-                                                 is_child_algorithm=True,
-                                                 context=context,
-                                                 feedback=feedback)['OUTPUT']
-                                                
-            # add a new field "dist" to PROJECTED_LAYER's attribute table
-            projected_layer = processing.run("native:addfieldtoattributestable",
-                                                {'INPUT':projected_layer,
-                                                'FIELD_NAME':'dist',
-                                                'FIELD_TYPE':1,
-                                                'FIELD_LENGTH':10,
-                                                'FIELD_PRECISION':3,
-                                                'OUTPUT':'TEMPORARY_OUTPUT'},
-                                                is_child_algorithm=True,
-                                                context=context,
-                                                feedback=feedback)['OUTPUT']
-
-            # DTM has been set, set PROJECTED_LAYER's Z value from it
+        # convert the result (which is a str id) as a vector layer
+        projected_layer = context.takeResultLayer(projected_layer)
+
+        projected_layer = self.grassProjection(axis_layer, invert_axis, projected_layer, dtm,
+                                               parameters, context, feedback)
+        
+        return self.results(projected_layer, None)
+
+    def results(self, projected_layer, snapped_layer):
+        """
+        Returns the results of the algorithm.
+        """
+        results = {'OUTPUT':projected_layer}
+        if snapped_layer is not None:
+            results['SNAPPED'] = snapped_layer
+        return results
+
+    def nativeProjection(self, axis_layer, invert_axis, projected_layer, dtm, parameters, context, feedback):
+        """
+        Samples the Z value and computes the curvilinear distance of the
+        vertices with the native engine and writes them to the output sink.
+        The vertices are read from the WKB of the lines of the projected
+        layer.
+        """
+        if self.parameterAsBool(parameters, 'USE_CACHE', context):
+            axis = AxisCache().get(axis_layer, invert_axis, feedback)
+        else:
+            axis = AxisModel.from_layer(axis_layer, invert_axis)
+
+        sampler = None
+        if dtm is not None:
+            sampler = RasterSampler(dtm, parameters['DTM_BAND'])
+
+        projector = PointProjector(axis, sampler)
+        projector.output_m = self.parameterAsBool(parameters, 'OUTPUT_M', context)
+        projector.add_offset = self.parameterAsBool(parameters, 'ADD_OFFSET', context)
+        projector.snapped = parameters.get('SNAPPED') is not None
+        projector.interpolate = self.parameterAsBool(parameters, 'INTERPOLATE', context)
+        # like the GRASS engine, only the interpolated vertices are deduplicated
+        if projector.interpolate and sampler is not None and parameters.get('DUPLICATE_TOLERANCE') is not None:
+            projector.deduplicator = Deduplicator(self.parameterAsDouble(parameters, 'DUPLICATE_TOLERANCE', context))
+        projector.add_fields()
+
+        # the vertices are transformed on the fly if the CRS differ
+        transform_context = context.transformContext()
+        projector.axis_transform = coordinate_transform(projected_layer.sourceCrs(), axis_layer.sourceCrs(),
+                                                        transform_context)
+        if dtm is not None:
+            projector.dtm_transform = coordinate_transform(projected_layer.sourceCrs(), dtm.crs(), transform_context)
+
+        # one point per vertex, with the dimensions of the lines
+        wkb_type = QgsWkbTypes.Point
+        if QgsWkbTypes.hasZ(projected_layer.wkbType()):
+            wkb_type = QgsWkbTypes.addZ(wkb_type)
+        if QgsWkbTypes.hasM(projected_layer.wkbType()):
+            wkb_type = QgsWkbTypes.addM(wkb_type)
+        if dtm is not None:
+            wkb_type = QgsWkbTypes.addZ(wkb_type)
+        if projector.output_m:
+            wkb_type = QgsWkbTypes.addM(wkb_type)
+
+        resampler = None
+        if parameters.get('RESAMPLING_STEP') is not None:
+            step = self.parameterAsDouble(parameters, 'RESAMPLING_STEP', context)
+            if step <= 0:
+                raise QgsProcessingException(self.tr('The resampling step must be greater than 0'))
+            resampler = ProfileResampler(step=step)
+        elif self.parameterAsInt(parameters, 'RESAMPLING_COUNT', context) > 1:
+            resampler = ProfileResampler(count=self.parameterAsInt(parameters, 'RESAMPLING_COUNT', context))
+        if resampler is not None:
+            return self.resampledProjection(projector, projected_layer, axis_layer, wkb_type, resampler,
+                                            parameters, context, feedback)
+
+        (sink, dest_id) = self.parameterAsSink(parameters, 'OUTPUT', context,
+                                               projector.fields, wkb_type, projected_layer.sourceCrs())
+
+        snapped_sink, snapped_id = None, None
+        if projector.snapped:
+            snapped_wkb_type = QgsWkbTypes.PointM if projector.output_m else QgsWkbTypes.Point
+            (snapped_sink, snapped_id) = self.parameterAsSink(parameters, 'SNAPPED', context,
+                                                              projector.fields, snapped_wkb_type,
+                                                              axis_layer.sourceCrs())
+
+        # the vertices attributes are not needed
+        request = QgsFeatureRequest().setNoAttributes()
+        workers = self.parameterAsInt(parameters, 'WORKERS', context)
+        # each worker reads, samples and projects the vertices of its own
+        # batches of lines, smaller ones so that the number of vertices in
+        # memory doesn't grow with the workers, progress is measured in lines
+        jobs = ((len(batch), projector.project_lines, batch)
+                for batch in line_batches(projected_layer.getFeatures(request), self.BATCH_SIZE // workers))
+        merge = projector.deduplicator.merge if projector.deduplicator is not None else None
+        self.writeBatches(jobs, [sink, snapped_sink], projected_layer.featureCount(), workers, feedback, merge)
+
+        return dest_id, snapped_id
+
+    def resampledProjection(self, projector, projected_layer, axis_layer, wkb_type, resampler, parameters, context, feedback):
+        """
+        Projects the vertices without writing them, then writes the
+        resampled profile : points of the axis at the resampling stations,
+        with the interpolated Z value.
+        """
+        request = QgsFeatureRequest().setNoAttributes()
+        workers = self.parameterAsInt(parameters, 'WORKERS', context)
+        jobs = ((len(batch), projector.profile_lines, batch)
+                for batch in line_batches(projected_layer.getFeatures(request), self.BATCH_SIZE // workers))
+        self.writeBatches(jobs, [], projected_layer.featureCount(), workers, feedback, resampler.collect)
+        if feedback.isCanceled():
+            return None, None
+
+        # the resampled points lie on the axis
+        resampled_wkb_type = QgsWkbTypes.Point
+        if QgsWkbTypes.hasZ(wkb_type):
+            resampled_wkb_type = QgsWkbTypes.addZ(resampled_wkb_type)
+        if projector.output_m:
+            resampled_wkb_type = QgsWkbTypes.addM(resampled_wkb_type)
+        (sink, dest_id) = self.parameterAsSink(parameters, 'OUTPUT', context,
+                                               projector.fields, resampled_wkb_type, axis_layer.sourceCrs())
+
+        dist, z = resampler.resample()
+        x, y = projector.axis.position(dist)
+        for batch in batches(range(len(dist)), self.BATCH_SIZE):
+            features = []
+            for current in batch:
+                point = QgsPoint(x[current], y[current])
+                if QgsWkbTypes.hasZ(resampled_wkb_type):
+                    point.addZValue(0. if np.isnan(z[current]) else float(z[current]))
+                if projector.output_m:
+                    point.addMValue(float(dist[current]))
+                feature = QgsFeature(projector.fields)
+                feature.setGeometry(QgsGeometry(point))
+                attributes = [float(dist[current]), None if np.isnan(z[current]) else float(z[current])]
+                if projector.add_offset:
+                    attributes.append(0.)
+                feature.setAttributes(attributes)
+                features.append(feature)
+            sink.addFeatures(features, QgsFeatureSink.FastInsert)
+        feedback.pushInfo(self.tr('{} resampled points').format(len(dist)))
+
+        return dest_id, None
+
+    def writeBatches(self, jobs, sinks, total, workers, feedback, merge=None):
+        """
+        Runs the (size, function, batch) jobs by a pool of workers, sharing
+        the (read only) projector, and writes their output features in
+        input order, each function returning one list of features per sink
+        (None sinks are skipped), possibly through a merge function called
+        in input order too. The number of batches in memory is bounded, so
+        that memory use doesn't depend on the number of projected points.
+        """
+        written = 0
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for size, function, batch in jobs:
+                if feedback.isCanceled():
+                    break
+                pending.append((size, executor.submit(function, batch)))
+                if len(pending) <= 2 * workers:
+                    continue
+                size, future = pending.popleft()
+                self.addFeatures(sinks, future.result() if merge is None else merge(future.result()))
+                written += size
+                feedback.setProgress(int(100 * written / total) if total > 0 else 0)
+
+            while pending and not feedback.isCanceled():
+                size, future = pending.popleft()
+                self.addFeatures(sinks, future.result() if merge is None else merge(future.result()))
+                written += size
+                feedback.setProgress(int(100 * written / total) if total > 0 else 0)
+            for size, future in pending:
+                future.cancel()
+
+    def addFeatures(self, sinks, features):
+        for sink, sink_features in zip(sinks, features):
+            if sink is not None:
+                sink.addFeatures(sink_features, QgsFeatureSink.FastInsert)
+
+    def grassProjection(self, axis_layer, invert_axis, projected_layer, dtm, parameters, context, feedback):
+        """
+        Samples the Z value of the vertices with a chain of child algorithms
+        and computes their curvilinear distance with GRASS v.distance.
+        """
+        # remove all fields created by the vertices extraction and add a new
+        # field "dist" to PROJECTED_LAYER's attribute table
+        projected_layer = subset_layer(projected_layer, [],
+                                       [QgsField('dist', QVariant.Double, len=10, prec=3)])
+
+        # if DTM has been set, set PROJECTED_LAYER's Z value from it
+        if dtm is not None:
             projected_layer = processing.run("native:setzfromraster",
                                              {'INPUT':projected_layer,
                                               'RASTER':dtm,
@@ -360,42 +1397,53 @@ class PolylineProjection(QgsProcessingAlgorithm):
                                              context=context,
                                              feedback=feedback)['OUTPUT']
 
-            # add a new field "Z" to PROJECTED_LAYER's attribute table                                  
-            projected_layer = processing.run("native:fieldcalculator",
-                                             {'INPUT':projected_layer,
-                                              'FIELD_NAME':'Z',
-                                              'FIELD_TYPE':0,
-                                              'FIELD_LENGTH':10,
-                                              'FIELD_PRECISION':3,
-                                              'FORMULA':'z($geometry)',
-                                              'OUTPUT':'TEMPORARY_OUTPUT'},
-                                             is_child_algorithm=True,
-                                             context=context,
-                                             feedback=feedback)['OUTPUT']
+        # add a new field "Z" to PROJECTED_LAYER's attribute table
+        projected_layer = processing.run("native:fieldcalculator",
+                                         {'INPUT':projected_layer,
+                                          'FIELD_NAME':'Z',
+                                          'FIELD_TYPE':0,
+                                          'FIELD_LENGTH':10,
+                                          'FIELD_PRECISION':3,
+                                          'FORMULA':'z($geometry)',
+                                          'OUTPUT':'TEMPORARY_OUTPUT'},
+                                         is_child_algorithm=True,
+                                         context=context,
+                                         feedback=feedback)['OUTPUT']
 
-            # execute v.distance algorithm                                 
-            projected_layer = processing.run("grass7:v.distance",
-                                             {'from':projected_layer,
-                                              'from_type':[0],
-                                              'to':axis_layer,
-                                              'to_type':[1],
-                                              'dmax':-1,
-                                              'dmin':-1,
-                                              'upload':[4],
-                                              'column':['dist'],
-                                              'to_column':'',
-                                              'from_output':parameters['OUTPUT'],
-                                              'output':'TEMPORARY_OUTPUT',
-                                              'GRASS_REGION_PARAMETER':None,
-                                              'GRASS_SNAP_TOLERANCE_PARAMETER':-1,
-                                              'GRASS_MIN_AREA_PARAMETER':0.0001,
-                                              'GRASS_OUTPUT_TYPE_PARAMETER':1,
-                                              'GRASS_VECTOR_DSCO':'',
-                                              'GRASS_VECTOR_LCO':'',
-                                              'GRASS_VECTOR_EXPORT_NOCAT':False},
-                                             is_child_algorithm=True,
-                                             context=context,
-                                             feedback=feedback)['from_output']
+        # delete all fields from AXIS_LAYER's attribute table
+        axis_layer = subset_layer(axis_layer, [])
+        
+        # if asked, invert the direction of the axis' line or polyline
+        if invert_axis:
+            axis_layer = processing.run("native:reverselinedirection",
+                                        {'INPUT':axis_layer,
+                                         'OUTPUT':'TEMPORARY_OUTPUT'},
+                                        is_child_algorithm=True,
+                                        context=context,
+                                        feedback=feedback)['OUTPUT']
         
-        # return the results of the algorithm
-        return {'OUTPUT':projected_layer}
+        # execute v.distance algorithm
+        projected_layer = processing.run("grass7:v.distance",
+                                         {'from':projected_layer,
+                                          'from_type':[0],
+                                          'to':axis_layer,
+                                          'to_type':[1],
+                                          'dmax':-1,
+                                          'dmin':-1,
+                                          'upload':[4],
+                                          'column':['dist'],
+                                          'to_column':'',
+                                          'from_output':parameters['OUTPUT'],
+                                          'output':'TEMPORARY_OUTPUT',
+                                          'GRASS_REGION_PARAMETER':None,
+                                          'GRASS_SNAP_TOLERANCE_PARAMETER':-1,
+                                          'GRASS_MIN_AREA_PARAMETER':0.0001,
+                                          'GRASS_OUTPUT_TYPE_PARAMETER':1,
+                                          'GRASS_VECTOR_DSCO':'',
+                                          'GRASS_VECTOR_LCO':'',
+                                          'GRASS_VECTOR_EXPORT_NOCAT':False},
+                                         is_child_algorithm=True,
+                                         context=context,
+                                         feedback=feedback)['from_output']
+
+        return projected_layer